@@ -1,50 +1,491 @@
-from isolation.isolation import _WIDTH, _HEIGHT
+import time
+from collections import defaultdict, namedtuple
+from multiprocessing import Pool, TimeoutError, Value
+
+from isolation.isolation import _WIDTH, _HEIGHT, _NEIGHBORS, _SIZE
+from search_board import SearchBoard
+from transposition import (EXACT, LOWER, UPPER, TABLE_SIZE, SharedTranspositionTable,
+                           zobrist_hash, zobrist_update)
+
+TIME_MARGIN = 20  # milliseconds of the move time limit left unused by the search
+TIME_CHECK_MASK = 0x3f  # check the deadline once every 64 nodes
+NULL_WINDOW = 1  # width of PVS null windows; heuristic scores are integers
+ASPIRATION_WINDOW = 5  # half-width of the PVS root window around the last score
+SEARCH_MODES = ("alphabeta", "pvs")
 
 #############################################################
 ###########      alpha beta pruning       ###################
 #############################################################
 
-def alpha_beta_search(state,play_id,depth=3):
-    """ Return the move along a branch of the game tree that
-    has the best possible value.
+class SearchTimeout(Exception):
+    """ Raised inside a search when its deadline has passed """
+
+
+class MoveOrdering():
+    """
+    Move ordering for alpha-beta search. Moves are tried in the order:
+
+    1. the best move from the transposition table (or previous iteration)
+    2. the killer moves that caused the latest cutoffs at the same ply
+    3. the remaining moves by history score (accumulated cutoffs by each
+       player into each cell, weighted by the square of the remaining depth)
+       and then by mobility (the number of open cells around the target)
+
+    Each stage can be switched off to compare orderings; with every stage
+    off the moves keep the order of Isolation.actions().
     """
-    def min_value(state, alpha, beta, depth):
-        if state.terminal_test():
-            return state.utility(play_id)
+    def __init__(self, killers=True, history=True, mobility=True, num_killers=2):
+        self.use_killers = killers
+        self.use_history = history
+        self.use_mobility = mobility
+        self.num_killers = num_killers
+        self.killers = defaultdict(list)  # ply -> most recent cutoff moves first
+        self.history = [[0] * _SIZE for _ in range(2)]  # player -> target cell -> score
+
+    def order(self, state, actions, ply, best_move=None):
+        """ Return the actions sorted so that the most promising come first """
+        board = state.board
+        player_id = state.player()
+        loc = state.locs[player_id]
+        killers = self.killers[ply] if self.use_killers else ()
+        history = self.history[player_id]
+        use_history, use_mobility = self.use_history, self.use_mobility
+        num_killers = self.num_killers
+
+        def priority(action):
+            target = action if loc is None else loc + action
+            if action == best_move:
+                return (num_killers + 1, 0, 0)
+            rank = num_killers - killers.index(action) if action in killers else 0
+            return (rank,
+                    history[target] if use_history else 0,
+                    (board & _NEIGHBORS[target]).bit_count() if use_mobility else 0)
+
+        return sorted(actions, key=priority, reverse=True)
+
+    def cutoff(self, state, action, ply, depth):
+        """ Record a move that caused a beta cutoff """
+        if self.use_killers:
+            killers = self.killers[ply]
+            if action not in killers:
+                killers.insert(0, action)
+                del killers[self.num_killers:]
+        if self.use_history:
+            player_id = state.player()
+            loc = state.locs[player_id]
+            target = action if loc is None else loc + action
+            self.history[player_id][target] += depth * depth
+
+
+class AlphaBetaSearch():
+    """
+    Depth-limited alpha-beta search from the perspective of player play_id.
+
+    If a TranspositionTable is given, positions are keyed by an incrementally
+    updated Zobrist hash, and results are read from and written to the table
+    so that they can be reused across transpositions, iterative deepening
+    iterations and turns.
+
+    If a MoveOrdering is given, the moves at every node are sorted by it and
+    it is updated with the moves that cause cutoffs; otherwise moves are
+    searched in the order returned by Isolation.actions().
+
+    If pvs is True, the search runs as Principal Variation Search: the first
+    move at each node is searched with the full window, and the others with
+    a null window that only proves them worse, re-searching the ones that
+    turn out better with the full window.
+
+    If incremental is True, the search plays moves on a single SearchBoard
+    with push() and pop() instead of creating a state for each node with
+    Isolation.result(), and takes the Zobrist hash from the board.
+
+    If a deadline (a time.perf_counter() value) is given, the search raises
+    SearchTimeout once it has passed. The number of nodes visited by all the
+    calls to search() is accumulated in self.nodes.
+    """
+    def __init__(self, play_id, table=None, deadline=None, ordering=None, pvs=False,
+                 incremental=False):
+        self.play_id = play_id
+        self.table = table
+        self.deadline = deadline
+        self.ordering = ordering
+        self.pvs = pvs
+        self.incremental = incremental
+        self.nodes = 0
+        self.best_score = None
+        self.root_depth = 0
+
+    def search(self, state, depth, first_move=None, alpha=float("-inf"), beta=float("inf")):
+        """ Return the move along a branch of the game tree that
+        has the best possible value; the value is kept in self.best_score.
+
+        first_move (e.g., the best move of the previous iteration) is searched
+        first when there is no transposition table entry for the state. If
+        the value is outside the (alpha, beta) window, self.best_score is only
+        an upper (<= alpha) or lower (>= beta) bound on it.
+        """
+        table = self.table
+        key = None
+        if self.incremental and not isinstance(state, SearchBoard):
+            state = SearchBoard(state)
+        actions = state.actions()
+        if table is not None:
+            key = state.key if self.incremental else zobrist_hash(state)
+            entry = table.probe(key)
+            if entry is not None and entry[4] in actions:
+                first_move = actions[actions.index(entry[4])]  # the Action member, not a bare int
+                if entry[1] >= depth and entry[2] == EXACT:
+                    self.best_score = entry[3]
+                    return first_move
+        if self.ordering is not None:
+            actions = self.ordering.order(state, actions, 0, first_move)
+        self.root_depth = depth
+
+        alpha0, beta0 = alpha, beta
+        best_score = float("-inf")
+        best_move = None
+        for i, action in enumerate(actions):
+            child_state, child_key = self.make(state, key, action)
+            if self.pvs and i and alpha != float("-inf"):
+                value = self.min_value(child_state, alpha, alpha + NULL_WINDOW, depth-1, child_key)
+                if alpha < value < beta:
+                    value = self.min_value(child_state, alpha, beta, depth-1, child_key)
+            else:
+                value = self.min_value(child_state, alpha, beta, depth-1, child_key)
+            if self.incremental:
+                state.pop()
+            alpha = max(alpha, value)
+            if best_move is None or value > best_score:
+                best_score = value
+                best_move = action
+            if value >= beta:
+                break
+        if table is not None and best_move is not None:
+            self.store(key, alpha0, beta0, depth, best_score, best_move)
+        self.best_score = best_score
+        return best_move
+
+    def min_value(self, state, alpha, beta, depth, key):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & TIME_CHECK_MASK and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        is_terminal, winner = state.outcome()
+        if is_terminal:
+            return float("inf") if winner == self.play_id else float("-inf")
         if depth <= 0:
-            return score(state,play_id)
+            return score(state,self.play_id)
+        tt_move = None
+        if self.table is not None:
+            cutoff, alpha, beta, tt_move = self.probe(key, alpha, beta, depth)
+            if cutoff is not None:
+                return cutoff
+        alpha0, beta0 = alpha, beta
         value = float("inf")
-        for action in state.actions():
-            value = min(value, max_value(state.result(action), alpha, beta, depth-1))
+        best_move = None
+        for i, action in enumerate(self.actions(state, depth, tt_move)):
+            child_state, child_key = self.make(state, key, action)
+            if self.pvs and i and beta != float("inf"):
+                child = self.max_value(child_state, beta - NULL_WINDOW, beta, depth-1, child_key)
+                if alpha < child < beta:
+                    child = self.max_value(child_state, alpha, beta, depth-1, child_key)
+            else:
+                child = self.max_value(child_state, alpha, beta, depth-1, child_key)
+            if self.incremental:
+                state.pop()
+            if child < value:
+                value, best_move = child, action
             if value <= alpha:
-                return value
+                if self.ordering is not None:
+                    self.ordering.cutoff(state, action, self.root_depth - depth, depth)
+                break
             beta = min(beta, value)
+        if self.table is not None:
+            self.store(key, alpha0, beta0, depth, value, best_move)
         return value
 
-    def max_value(state, alpha, beta, depth):
-        if state.terminal_test():
-            return state.utility(play_id)
-        if depth <= 0: return score(state,play_id)
+    def max_value(self, state, alpha, beta, depth, key):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & TIME_CHECK_MASK and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        is_terminal, winner = state.outcome()
+        if is_terminal:
+            return float("inf") if winner == self.play_id else float("-inf")
+        if depth <= 0: return score(state,self.play_id)
+        tt_move = None
+        if self.table is not None:
+            cutoff, alpha, beta, tt_move = self.probe(key, alpha, beta, depth)
+            if cutoff is not None:
+                return cutoff
+        alpha0, beta0 = alpha, beta
         value = float("-inf")
-        for action in state.actions():
-            value = max(value, min_value(state.result(action), alpha, beta, depth-1))
+        best_move = None
+        for i, action in enumerate(self.actions(state, depth, tt_move)):
+            child_state, child_key = self.make(state, key, action)
+            if self.pvs and i and alpha != float("-inf"):
+                child = self.min_value(child_state, alpha, alpha + NULL_WINDOW, depth-1, child_key)
+                if alpha < child < beta:
+                    child = self.min_value(child_state, alpha, beta, depth-1, child_key)
+            else:
+                child = self.min_value(child_state, alpha, beta, depth-1, child_key)
+            if self.incremental:
+                state.pop()
+            if child > value:
+                value, best_move = child, action
             if value >= beta:
-                return value
+                if self.ordering is not None:
+                    self.ordering.cutoff(state, action, self.root_depth - depth, depth)
+                break
             alpha = max(alpha, value)
+        if self.table is not None:
+            self.store(key, alpha0, beta0, depth, value, best_move)
         return value
 
+    def actions(self, state, depth, tt_move):
+        """ Return the actions of an interior node in search order """
+        actions = state.actions()
+        if self.ordering is None or len(actions) < 2:
+            return actions
+        return self.ordering.order(state, actions, self.root_depth - depth, tt_move)
+
+    def probe(self, key, alpha, beta, depth):
+        """ Return (value, alpha, beta, move); value is not None on a cutoff,
+        and move is the best move stored for the position (or None)
+        """
+        entry = self.table.probe(key)
+        if entry is None:
+            return None, alpha, beta, None
+        if entry[1] >= depth:
+            value, bound = entry[3], entry[2]
+            if bound == EXACT:
+                return value, alpha, beta, entry[4]
+            if bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, alpha, beta, entry[4]
+        return None, alpha, beta, entry[4]
+
+    def store(self, key, alpha, beta, depth, value, move):
+        if value <= alpha:
+            bound = UPPER
+        elif value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, bound, value, move)
+
+    def make(self, state, key, action):
+        """ Return the child state reached by action and its key; with an
+        incremental search the move is pushed on the board, and the caller
+        pops it after searching the child
+        """
+        if self.incremental:
+            state.push(action)
+            return state, state.key
+        return state.result(action), self.child_key(state, key, action)
+
+    def child_key(self, state, key, action):
+        if self.table is None:
+            return None
+        player_id = state.player()
+        old_loc = state.locs[player_id]
+        new_loc = action if old_loc is None else old_loc + action
+        return zobrist_update(key, player_id, old_loc, new_loc)
+
+
+def alpha_beta_search(state,play_id,depth=3,table=None,ordering=None,incremental=False):
+    """ Return the move along a branch of the game tree that
+    has the best possible value.
+
+    See Also: AlphaBetaSearch
+    """
+    return AlphaBetaSearch(play_id, table, ordering=ordering, incremental=incremental).search(state, depth)
+
+
+
+#############################################################
+###########     iterative deepening       ###################
+#############################################################
+
+DepthReport = namedtuple("DepthReport", "depth nodes elapsed ebf move score")
+
+
+def iterative_deepening(state, play_id, publish, time_left=None, table=None, max_depth=None,
+                        ordering=None, mode="alphabeta", incremental=False):
+    """ Search to increasing depths until time runs out, calling publish(move)
+    with the best move found after every completed depth.
+
+    The search stops at the first of: the deadline (time_left milliseconds
+    minus TIME_MARGIN), a depth that is not expected to finish in the time
+    remaining, a proven win or loss, or max_depth (default: the number of open
+    cells on the board). Without time_left the search runs to max_depth.
+
+    Returns a list of DepthReport tuples, one for each completed depth, with
+    the nodes searched, elapsed seconds and effective branching factor (the
+    ratio of nodes searched to those of the previous depth).
+
+    The table, ordering and incremental options (see AlphaBetaSearch) apply
+    to all depths, and each depth searches the best move of the previous
+    depth first.
+
+    mode is one of SEARCH_MODES. "pvs" runs Principal Variation Search with
+    an aspiration window of +/- ASPIRATION_WINDOW around the score of the
+    previous depth, widening the window and searching again on a fail low or
+    fail high; the nodes of every attempt count towards the depth.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError("Unknown search mode {!r}; choose from {}".format(mode, SEARCH_MODES))
+    start = time.perf_counter()
+    deadline = None if time_left is None else start + (time_left - TIME_MARGIN) / 1000.
+    if max_depth is None:
+        max_depth = state.board.bit_count()
+    reports = []
+    for depth in range(1, max_depth + 1):
+        search = AlphaBetaSearch(play_id, table, deadline, ordering, pvs=(mode == "pvs"),
+                                 incremental=incremental)
+        first_move = reports[-1].move if reports else None
+        alpha, beta = float("-inf"), float("inf")
+        if mode == "pvs" and reports and abs(reports[-1].score) != float("inf"):
+            alpha, beta = reports[-1].score - ASPIRATION_WINDOW, reports[-1].score + ASPIRATION_WINDOW
+        depth_start = time.perf_counter()
+        try:
+            while True:
+                move = search.search(state, depth, first_move, alpha, beta)
+                if search.best_score <= alpha != float("-inf"):
+                    alpha = float("-inf")  # fail low
+                elif search.best_score >= beta != float("inf"):
+                    beta = float("inf")  # fail high
+                else:
+                    break
+        except SearchTimeout:
+            break
+        now = time.perf_counter()
+        prev_nodes = reports[-1].nodes if reports else 0
+        ebf = search.nodes / prev_nodes if prev_nodes else float(search.nodes)
+        reports.append(DepthReport(depth, search.nodes, now - depth_start, ebf, move, search.best_score))
+        publish(move)
+        if abs(search.best_score) == float("inf"):
+            break  # the game result is proven; deeper search cannot change it
+        if deadline is not None and now + (now - depth_start) * max(ebf, 1.) > deadline:
+            break  # the next depth is not expected to finish in time
+    return reports
+
+
+#############################################################
+###########    parallel root splitting    ###################
+#############################################################
+
+_worker = {}  # search state of a parallel search worker process; see _init_worker()
+
+
+def _init_worker(play_id, table, alpha, deadline, incremental=False):
+    _worker.update(play_id=play_id, table=table, alpha=alpha, deadline=deadline,
+                   ordering=MoveOrdering(), incremental=incremental)
+
+
+def _search_root_move(state, action, depth):
+    """ Search one root move in a worker process with the window
+    (shared alpha, +inf); return (action, value, alpha, nodes), where value
+    is None if the deadline passed
+    """
+    search = AlphaBetaSearch(_worker["play_id"], _worker["table"], _worker["deadline"],
+                             _worker["ordering"], incremental=_worker["incremental"])
+    search.root_depth = depth
+    shared_alpha = _worker["alpha"]
+    alpha = shared_alpha.value
+    if search.incremental:
+        child = SearchBoard(state)
+        child.push(action)
+        key = child.key
+    else:
+        child = state.result(action)
+        key = zobrist_hash(child)
+    try:
+        value = search.min_value(child, alpha, float("inf"), depth - 1, key)
+    except SearchTimeout:
+        return action, None, alpha, search.nodes
+    with shared_alpha.get_lock():
+        if value > shared_alpha.value:
+            shared_alpha.value = value
+    return action, value, alpha, search.nodes
+
+
+def parallel_iterative_deepening(state, play_id, publish, time_left=None, max_depth=None,
+                                 processes=None, table_size=TABLE_SIZE, incremental=False):
+    """ Iterative deepening that splits the root moves of each depth across a
+    pool of worker processes (Young Brothers Wait: the first move in order is
+    searched alone to establish a bound, then the rest are searched in
+    parallel). The workers share the best root value found so far as their
+    alpha bound, and a SharedTranspositionTable.
+
+    A legal move is published before the pool starts, and the best move is
+    published after every completed depth. Time limits, stopping rules and the
+    returned DepthReport list follow iterative_deepening(); nodes are summed
+    over all workers.
+    """
+    start = time.perf_counter()
+    deadline = None if time_left is None else start + (time_left - TIME_MARGIN) / 1000.
+    if max_depth is None:
+        max_depth = state.board.bit_count()
+    actions = state.actions()
+    publish(actions[0])
+    if len(actions) == 1:
+        return []
+
+    table = SharedTranspositionTable(table_size)
+    alpha = Value("d", float("-inf"))
+    ordering = MoveOrdering(killers=False, history=False)
+    reports = []
+    with Pool(processes, _init_worker, (play_id, table, alpha, deadline, incremental)) as pool:
+        for depth in range(1, max_depth + 1):
+            depth_start = time.perf_counter()
+            alpha.value = float("-inf")
+            order = ordering.order(state, actions, 0, reports[-1].move if reports else None)
+            results = _run_root_tasks(pool, state, order, depth, deadline)
+            if results is None:
+                break
+            best_move, best_score = order[0], float("-inf")
+            for action, value, used_alpha, _ in sorted(results, key=lambda r: order.index(r[0])):
+                exact = value > used_alpha or used_alpha == float("-inf")
+                if exact and value > best_score:
+                    best_move, best_score = action, value
+            now = time.perf_counter()
+            nodes = sum(r[3] for r in results)
+            prev_nodes = reports[-1].nodes if reports else 0
+            ebf = nodes / prev_nodes if prev_nodes else float(nodes)
+            reports.append(DepthReport(depth, nodes, now - depth_start, ebf, best_move, best_score))
+            publish(best_move)
+            if abs(best_score) == float("inf"):
+                break  # the game result is proven; deeper search cannot change it
+            if deadline is not None and now + (now - depth_start) * max(ebf, 1.) > deadline:
+                break  # the next depth is not expected to finish in time
+    return reports
+
+
+def _run_root_tasks(pool, state, order, depth, deadline):
+    """ Return the results of searching every root move, or None if the
+    deadline passes first
+    """
+    def wait(task):
+        timeout = None if deadline is None else max(0., deadline - time.perf_counter())
+        try:
+            result = task.get(timeout)
+        except TimeoutError:
+            return None
+        return None if result[1] is None else result
 
-    alpha = float("-inf")
-    beta = float("inf")
-    best_score = float("-inf")
-    best_move = None
-    for action in state.actions():
-        value = min_value(state.result(action), alpha, beta, depth-1)
-        alpha = max(alpha, value)
-        if value >= best_score:
-            best_score = value
-            best_move = action
-    return best_move
+    first = wait(pool.apply_async(_search_root_move, (state, order[0], depth)))
+    if first is None:
+        return None
+    tasks = [pool.apply_async(_search_root_move, (state, action, depth)) for action in order[1:]]
+    results = [first]
+    for task in tasks:
+        result = wait(task)
+        if result is None:
+            return None
+        results.append(result)
+    return results
 
 
 
@@ -58,16 +499,14 @@ def distance(state):
 
 
 def score(state,play_id):
-    own_loc = state.locs[play_id]
-    opp_loc = state.locs[1 - play_id]
-    own_liberties = state.liberties(own_loc)
-    opp_liberties = state.liberties(opp_loc)
+    own_liberties = state.num_liberties(play_id)
+    opp_liberties = state.num_liberties(1 - play_id)
 
     dis = distance(state)
     if dis >= 2:
-        return 2*len(own_liberties) - len(opp_liberties)
+        return 2*own_liberties - opp_liberties
     else:
         # states away from walls from be encouraged, so the weight is bigger
-        return len(own_liberties) - len(opp_liberties)
+        return own_liberties - opp_liberties
 
 
@@ -0,0 +1,521 @@
+""" Micro-benchmarks for the isolation game engine and the search code
+
+Each benchmark runs on a deterministic set of positions sampled from seeded
+random games, so numbers are comparable between commits on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import textwrap
+import time
+import tracemalloc
+
+from isolation import Isolation, SearchStats
+from my_custom_player import CustomPlayer_MCTS
+from sample_players import GreedyPlayer, MinimaxPlayer
+from transposition import TranspositionTable
+import _utils
+import mcts
+import symmetry
+
+NUM_STATES = 200  # number of positions sampled for each benchmark
+REPEAT = 5  # number of timing runs; the best run is reported
+SEED = 0
+TIME_LIMIT = 150  # milliseconds per move for time-bounded searches
+SUITE_SIZE = 20  # number of positions in the fixed search suite
+SUITE_PLY = 10  # number of random moves played to reach each suite position
+SEARCH_DEPTH = 8  # depth limit for fixed-depth searches on the suite
+PLAYOUTS = 1000  # number of playouts per position for MCTS benchmarks
+BATCH_SIZES = (1, 8, 32, 128, 512)  # games per batch for batched rollouts
+SUITE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_suite.json")
+SUITE_VERSION = 1  # bump when the positions in SUITE_FILE change
+SUITE_PLIES = (8, 16, 24)  # move numbers of the positions in SUITE_FILE
+MINIMAX_DEPTH = 5  # depth limit for MinimaxPlayer.minimax, which does not prune
+TOLERANCE = 0.2  # relative change of a benchmark result reported as a regression
+
+
+def sample_states(num_states=NUM_STATES, seed=SEED):
+    """ Return a list of non-terminal states collected by playing seeded
+    random games from the empty board
+    """
+    rng = random.Random(seed)
+    states = []
+    while len(states) < num_states:
+        state = Isolation()
+        while not state.terminal_test() and len(states) < num_states:
+            states.append(state)
+            state = state.result(rng.choice(state.actions()))
+    return states
+
+
+def position_suite(num_positions=SUITE_SIZE, ply=SUITE_PLY, seed=SEED):
+    """ Return a list of mid-game positions, each reached by playing `ply`
+    random moves from the empty board in a seeded game
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < num_positions:
+        state = Isolation()
+        while not state.terminal_test() and state.ply_count < ply:
+            state = state.result(rng.choice(state.actions()))
+        if not state.terminal_test():
+            positions.append(state)
+    return positions
+
+
+def write_suite(path=SUITE_FILE, plies=SUITE_PLIES, num_positions=SUITE_SIZE // 5):
+    """ Write a fixed suite of positions (num_positions from seeded random
+    games at each number of plies) for the engines benchmark. The suite is
+    stored in a file so that results stay comparable if the random module
+    or position_suite() changes; bump SUITE_VERSION when rewriting it.
+    """
+    positions = [s for ply in plies for s in position_suite(num_positions, ply, seed=ply)]
+    lines = [json.dumps({"board": s.board, "ply_count": s.ply_count, "locs": list(s.locs)})
+             for s in positions]
+    with open(path, "w") as f:
+        f.write('{{"version": {}, "positions": [\n{}\n]}}\n'.format(SUITE_VERSION, ",\n".join(lines)))
+
+
+def load_suite(path=SUITE_FILE):
+    """ Return the positions of the suite file as Isolation states """
+    with open(path) as f:
+        suite = json.load(f)
+    if suite["version"] != SUITE_VERSION:
+        raise ValueError("{} is version {} of the suite, expected {}".format(
+            path, suite["version"], SUITE_VERSION))
+    return [Isolation(board=p["board"], ply_count=p["ply_count"], locs=tuple(p["locs"]))
+            for p in suite["positions"]]
+
+
+def _calls_per_sec(func, args, repeat=REPEAT):
+    """ Return the best observed rate of calls per second for func(*a) over
+    every argument tuple in args
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for a in args:
+            func(*a)
+        best = min(best, time.perf_counter() - start)
+    return len(args) / best, "calls/sec"
+
+
+def bench_movegen(states):
+    """ Benchmark the move generation methods of the Isolation class """
+    placed = [s for s in states if None not in s.locs]
+    return {
+        "actions": _calls_per_sec(Isolation.actions, [(s,) for s in placed]),
+        "liberties": _calls_per_sec(Isolation.liberties, [(s, s.locs[1 - s.player()]) for s in placed]),
+        "opening_actions": _calls_per_sec(Isolation.actions, [(Isolation(),)] * len(placed)),
+    }
+
+
+def bench_eval(states):
+    """ Benchmark the built-in heuristic evaluation functions """
+    placed = [(s,) for s in states if None not in s.locs]
+    return {
+        "_utils.score": _calls_per_sec(lambda s: _utils.score(s, 0), placed),
+        "MinimaxPlayer.score": _calls_per_sec(MinimaxPlayer(0).score, placed),
+        "GreedyPlayer.score": _calls_per_sec(GreedyPlayer(0).score, placed),
+    }
+
+
+def bench_terminal(states):
+    """ Benchmark the terminal test and utility queries made at each search node """
+    args = [(s.result(a),) for s in states for a in s.actions()]  # includes terminal states
+    def terminal_then_utility(state):
+        if state.terminal_test(): return state.utility(0)
+    return {
+        "terminal_test+utility": _calls_per_sec(terminal_then_utility, args),
+        "outcome": _calls_per_sec(Isolation.outcome, args),
+    }
+
+
+def bench_symmetry(states):
+    """ Benchmark mapping states to their canonical symmetric representative """
+    args = [(s,) for s in states]
+    return {
+        "canonicalize": _calls_per_sec(symmetry.canonicalize, args),
+        "transform_state LRUD": _calls_per_sec(symmetry.transform_state, [(s, symmetry.LRUD) for s in states]),
+    }
+
+
+def bench_deepening(states, time_limit=TIME_LIMIT):
+    """ Benchmark the depth reached by time-bounded iterative deepening """
+    placed = [s for s in states if None not in s.locs][::10]
+    depths, nodes, elapsed = [], 0, 0.
+    for state in placed:
+        reports = _utils.iterative_deepening(state, state.player(), lambda move: None, time_limit)
+        depths.append(reports[-1].depth)
+        nodes += sum(r.nodes for r in reports)
+        elapsed += sum(r.elapsed for r in reports)
+    return {
+        "mean_depth": (sum(depths) / len(depths), "plies"),
+        "min_depth": (min(depths), "plies"),
+        "nps": (nodes / elapsed, "nodes/sec"),
+    }
+
+
+ORDERINGS = {
+    "none": lambda: (None, None),
+    "mobility": lambda: (None, _utils.MoveOrdering(killers=False, history=False)),
+    "tt": lambda: (TranspositionTable(), _utils.MoveOrdering(killers=False, history=False, mobility=False)),
+    "tt+killers": lambda: (TranspositionTable(), _utils.MoveOrdering(history=False, mobility=False)),
+    "tt+killers+history": lambda: (TranspositionTable(), _utils.MoveOrdering(mobility=False)),
+    "full": lambda: (TranspositionTable(), _utils.MoveOrdering()),
+}
+
+
+def bench_ordering(states, depth=SEARCH_DEPTH):
+    """ Count the nodes searched by iterative deepening on the position suite
+    with each move ordering; the states argument is ignored
+    """
+    results = {}
+    for name, make in ORDERINGS.items():
+        nodes = [0] * depth
+        start = time.perf_counter()
+        for state in position_suite():
+            table, ordering = make()
+            reports = _utils.iterative_deepening(state, state.player(), lambda move: None,
+                                                 table=table, max_depth=depth, ordering=ordering)
+            for r in reports:
+                nodes[r.depth - 1] += r.nodes
+        for d in range(depth):
+            results["{} d{}".format(name, d + 1)] = (nodes[d], "nodes")
+        results[name + " time"] = (time.perf_counter() - start, "sec")
+    return results
+
+
+def bench_modes(states, depth=SEARCH_DEPTH, time_limit=TIME_LIMIT):
+    """ Compare the search modes on the position suite: nodes and time for
+    iterative deepening to a fixed depth, and the depth reached within the
+    time limit; the states argument is ignored
+    """
+    results = {}
+    for mode in _utils.SEARCH_MODES:
+        nodes, start = 0, time.perf_counter()
+        for state in position_suite():
+            reports = _utils.iterative_deepening(state, state.player(), lambda move: None, None,
+                                                 TranspositionTable(), depth, _utils.MoveOrdering(), mode)
+            nodes += sum(r.nodes for r in reports)
+        results[mode + " nodes"] = (nodes, "nodes")
+        results[mode + " time"] = (time.perf_counter() - start, "sec")
+        depths = []
+        for state in position_suite():
+            reports = _utils.iterative_deepening(state, state.player(), lambda move: None, time_limit,
+                                                 TranspositionTable(), None, _utils.MoveOrdering(), mode)
+            depths.append(reports[-1].depth)
+        results[mode + " mean_depth"] = (sum(depths) / len(depths), "plies")
+    return results
+
+
+def bench_incremental(states, depth=SEARCH_DEPTH):
+    """ Compare fixed-depth iterative deepening on the position suite with
+    states created by Isolation.result() and with SearchBoard push/pop; the
+    states argument is ignored
+    """
+    results = {}
+    for name, incremental in (("result", False), ("push/pop", True)):
+        nodes, start = 0, time.perf_counter()
+        for state in position_suite():
+            reports = _utils.iterative_deepening(state, state.player(), lambda move: None, None,
+                                                 TranspositionTable(), depth, _utils.MoveOrdering(),
+                                                 incremental=incremental)
+            nodes += sum(r.nodes for r in reports)
+        elapsed = time.perf_counter() - start
+        results[name + " time"] = (elapsed, "sec")
+        results[name + " nps"] = (nodes / elapsed, "nodes/sec")
+    return results
+
+
+def bench_rollout(states):
+    """ Benchmark random playouts to the end of the game from each position """
+    args = [(s,) for s in states]
+    random.seed(SEED)
+    results = {
+        "default_policy": _calls_per_sec(mcts.default_policy, args),
+        "rollout": _calls_per_sec(mcts.rollout, [(s.board, s.locs[0], s.locs[1], s.ply_count)
+                                                 for s in states]),
+    }
+    if mcts.np is not None:
+        rng = mcts.np.random.default_rng(SEED)
+        for size in BATCH_SIZES:
+            rate, _ = _calls_per_sec(mcts.batch_rollout, [([s] * size, rng) for s in states[::size // 4 or 1]])
+            results["batch_rollout x{}".format(size)] = (rate * size, "rollouts/sec")
+    return results
+
+
+def _grow_nodes(state, playouts):
+    """ Run MCTS playouts with linked MCTS_Node objects; return the root """
+    root = mcts.MCTS_Node(state)
+    for _ in range(playouts):
+        child = mcts.tree_policy(root)
+        mcts.backup(child, mcts.default_policy(child.state))
+    return root
+
+
+def _count_nodes(root):
+    count, stack = 0, [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+
+def bench_tree(states, playouts=PLAYOUTS):
+    """ Compare the MCTS tree representations on the position suite: nodes
+    added per second of search (including playouts), and the memory
+    allocated per node; the states argument is ignored
+    """
+    results = {}
+    for name, grow, count in TREES:
+        nodes, elapsed, size = 0, 0., 0
+        for i, state in enumerate(position_suite()):
+            random.seed(SEED + i)
+            start = time.perf_counter()
+            nodes += count(grow(state, playouts))
+            elapsed += time.perf_counter() - start
+            random.seed(SEED + i)  # grow the same tree again to measure its memory
+            tracemalloc.start()
+            tree = grow(state, playouts)
+            size += tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del tree
+        results[name + " nodes/sec"] = (nodes / elapsed, "nodes/sec")
+        results[name + " memory"] = (size / nodes, "bytes/node")
+    return results
+
+
+def _grow_tree(state, playouts):
+    """ Run MCTS playouts with an array-backed MCTS_Tree; return the tree """
+    tree = mcts.MCTS_Tree(state)
+    for _ in range(playouts):
+        node, leaf = tree.select()
+        tree.backup(node, mcts.default_policy(leaf))
+    return tree
+
+
+TREES = [
+    ("MCTS_Node", _grow_nodes, _count_nodes),
+    ("MCTS_Tree", _grow_tree, lambda tree: sum(tree.num_tried) + 1),
+]
+
+
+def _search_alpha_beta(state):
+    # alpha_beta_search() with its default options, keeping the search to count its nodes
+    search = _utils.AlphaBetaSearch(state.player())
+    return search.search(state, SEARCH_DEPTH), search.nodes
+
+
+def _player_search(player_class, search):
+    """ Return a function that runs search(player, state) with a fresh player
+    state for the side to move, and returns the move and the nodes the
+    player counted in its SearchStats; the player is created (and loads its
+    opening book) once, outside the timed searches
+    """
+    player = player_class(0)
+    player.queue = queue.Queue()
+
+    def run(state):
+        player.player_id, player.context, player.stats = state.player(), None, SearchStats()
+        return search(player, state), player.stats.nodes
+    return run
+
+
+def _set_playouts(player, state):
+    player.playouts = PLAYOUTS
+    return player.mcts(state)
+
+
+# (name, function returning a search function of a state) for bench_engines()
+ENGINES = [
+    ("alpha_beta_search", lambda: _search_alpha_beta),
+    ("MinimaxPlayer.minimax", lambda: _player_search(
+        MinimaxPlayer, lambda player, state: player.minimax(state, MINIMAX_DEPTH))),
+    ("CustomPlayer_MCTS.mcts", lambda: _player_search(CustomPlayer_MCTS, _set_playouts)),
+]
+
+
+def bench_engines(states):
+    """ Run each search engine to a fixed depth (SEARCH_DEPTH for
+    alpha_beta_search, MINIMAX_DEPTH for MinimaxPlayer.minimax) or number of
+    playouts (PLAYOUTS for CustomPlayer_MCTS.mcts) on every position of the
+    suite file; report the nodes and chosen move for each position, and the
+    total nodes, time (the sum of the best of REPEAT runs on each position)
+    and nodes per second of each engine. Random number
+    generators are seeded for each search, so nodes and moves only change
+    with the search code. The states argument is ignored.
+    """
+    results = {}
+    positions = load_suite()
+    for name, make in ENGINES:
+        search = make()
+        total_nodes, elapsed = 0, 0.
+        for i, state in enumerate(positions):
+            best = float("inf")
+            for _ in range(REPEAT):
+                random.seed(SEED + i)
+                start = time.perf_counter()
+                move, nodes = search(state)
+                best = min(best, time.perf_counter() - start)
+            elapsed += best
+            total_nodes += nodes
+            results["{} #{} nodes".format(name, i)] = (nodes, "nodes")
+            results["{} #{} move".format(name, i)] = (None if move is None else int(move), "move")
+        results[name + " nodes"] = (total_nodes, "nodes")
+        results[name + " time"] = (elapsed, "sec")
+        results[name + " nps"] = (total_nodes / elapsed, "nodes/sec")
+    return results
+
+
+BENCHMARKS = {
+    "movegen": bench_movegen,
+    "eval": bench_eval,
+    "terminal": bench_terminal,
+    "symmetry": bench_symmetry,
+    "deepening": bench_deepening,
+    "ordering": bench_ordering,
+    "modes": bench_modes,
+    "incremental": bench_incremental,
+    "tree": bench_tree,
+    "rollout": bench_rollout,
+    "engines": bench_engines,
+}
+
+# units of results that are better when larger; the other numeric results
+# (times, node counts, memory) are better when smaller, and moves are compared
+# for equality
+HIGHER_IS_BETTER = {"calls/sec", "nodes/sec", "rollouts/sec", "plies"}
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    """
+    Compare benchmark results with a baseline from an earlier run; results
+    missing from either side are skipped.
+
+    :param baseline: dict; benchmark -> label -> (value, unit)
+    :param results: dict; benchmark -> label -> (value, unit)
+    :param tolerance: float; the relative change in the worse direction
+        reported as a regression
+    :return: (list, list); (benchmark, label, old, new) tuples of the
+        regressions and of the changed moves
+    """
+    regressions, changed = [], []
+    for name, entries in results.items():
+        for label, (value, unit) in entries.items():
+            if label not in baseline.get(name, {}):
+                continue
+            old = baseline[name][label][0]
+            if unit == "move":
+                if value != old:
+                    changed.append((name, label, old, value))
+            elif unit in HIGHER_IS_BETTER and value < old * (1 - tolerance):
+                regressions.append((name, label, old, value))
+            elif unit not in HIGHER_IS_BETTER and value > old * (1 + tolerance):
+                regressions.append((name, label, old, value))
+    return regressions, changed
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(args):
+    if args.write_suite:
+        write_suite()
+        print("Wrote version {} of the position suite to {}".format(SUITE_VERSION, SUITE_FILE))
+        return
+    states = sample_states(args.states, args.seed)
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        results[name] = BENCHMARKS[name](states)
+        for label, (value, unit) in results[name].items():
+            if unit == "move":
+                print("{:>10} {:>30}: {!s:>12}".format(name, label, value))
+            else:
+                print("{:>10} {:>30}: {:>12,.1f} {}".format(name, label, value, unit))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"revision": _git_revision(), "suite_version": SUITE_VERSION,
+                       "python": platform.python_version(), "states": args.states, "seed": args.seed,
+                       "results": results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["suite_version"] != SUITE_VERSION:
+            sys.exit("{} used version {} of the position suite, not {}".format(
+                args.compare, baseline["suite_version"], SUITE_VERSION))
+        regressions, changed = compare(baseline["results"], results, args.tolerance)
+        for name, label, old, new in changed:
+            print("changed {} {}: {} -> {}".format(name, label, old, new))
+        for name, label, old, new in regressions:
+            print("REGRESSION {} {}: {:,.1f} -> {:,.1f}".format(name, label, old, new))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Run micro-benchmarks of the game engine and search code.",
+        epilog=textwrap.dedent("""\
+            Example Usage:
+            --------------
+            - Benchmark move generation on 500 sampled positions:
+
+                $python bench.py movegen -n 500
+
+            - Save the search engine results on the position suite, then check a later
+              commit against them (exits with status 1 on a regression):
+
+                $python bench.py engines -j base.json
+                $python bench.py engines -c base.json
+        """)
+    )
+    parser.add_argument(
+        'benchmarks', nargs='*', metavar="BENCHMARK",
+        help="Choose the benchmarks to run from {} (default: all).".format(", ".join(BENCHMARKS))
+    )
+    parser.add_argument(
+        '-n', '--states', type=int, default=NUM_STATES,
+        help="Set the number of sampled positions used by each benchmark."
+    )
+    parser.add_argument(
+        '-s', '--seed', type=int, default=SEED,
+        help="Set the random seed used to sample positions."
+    )
+    parser.add_argument(
+        '-j', '--json', metavar="FILE",
+        help="Write the results to a JSON file, with the git revision and suite version."
+    )
+    parser.add_argument(
+        '-c', '--compare', metavar="FILE",
+        help="""\
+            Compare the results with those in a JSON file written by --json; print the 
+            changed moves and the regressions, and exit with status 1 if there are any 
+            regressions.
+        """
+    )
+    parser.add_argument(
+        '-t', '--tolerance', type=float, default=TOLERANCE,
+        help="Set the relative change of a result reported as a regression."
+    )
+    parser.add_argument(
+        '--write_suite', action="store_true",
+        help="Regenerate the position suite file used by the engines benchmark."
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+    main(args)
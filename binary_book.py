@@ -0,0 +1,181 @@
+## Memory-mapped binary opening book
+#
+# A book file is a header followed by fixed-width records, one for each
+# (canonical state, action) pair, sorted by the Zobrist hash of the state.
+# The records of a state are adjacent, best action first. A lookup
+# canonicalizes the state, binary searches for its hash in the memory-mapped
+# file, and checks the full position stored in the record, so hash collisions
+# cannot return a wrong move. The file is opened lazily on the first lookup,
+# and the mapping is shared by the processes forked after that, and through
+# the page cache by every process that opens the same file.
+
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+from isolation.isolation import Action
+from symmetry import canonicalize, inverse_action, transform_action
+from transposition import zobrist_hash
+
+BOOK_FILE = "data.bin"
+MAGIC = b"ISOBOOK\0"
+VERSION = 1
+
+# magic, version, record size, number of records
+_HEADER = struct.Struct("<8sIIQ")
+# state hash, board, ply count, locations (255 is None), action, visits, wins
+_RECORD = struct.Struct("<Q16sBBBxhIi6x")
+_NO_LOC = 0xff
+_BOARD_BYTES = 16
+
+
+def _record(state, action, visits=0, wins=0):
+    locs = [_NO_LOC if loc is None else loc for loc in state.locs]
+    return _RECORD.pack(zobrist_hash(state), state.board.to_bytes(_BOARD_BYTES, "little"),
+                        state.ply_count, locs[0], locs[1], int(action), visits, wins)
+
+
+def write_book(path, entries):
+    """
+    Write a binary book.
+
+    :param path: str; the output file, replaced atomically
+    :param entries: iterable of (state, action, visits, wins); the states
+        are canonicalized, and the entries of each state are kept in the
+        order given, so the preferred action of a state must come first
+    :return: int; the number of records written
+    """
+    records = []
+    for i, (state, action, visits, wins) in enumerate(entries):
+        canonical, transform = canonicalize(state)
+        records.append((zobrist_hash(canonical), i,
+                        _record(canonical, transform_action(action, transform), visits, wins)))
+    records.sort(key=lambda r: r[:2])
+    with open(path + ".tmp", "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, _RECORD.size, len(records)))
+        for _, _, record in records:
+            f.write(record)
+    os.replace(path + ".tmp", path)
+    return len(records)
+
+
+def convert(pickle_path, path):
+    """
+    Convert a pickled book to a binary book. Accepts a state -> action
+    table (data.pickle) or an opening_book checkpoint, whose visit and win
+    counts are stored for every action, best first (see
+    opening_book.best_action).
+
+    :return: int; the number of records written
+    """
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    if isinstance(data, dict) and "book" in data and "version" in data:
+        from opening_book import load_checkpoint, win_rate_bounds
+        book = load_checkpoint(pickle_path)["book"]
+        return write_book(path, ((state, action, stats.visits, stats.wins)
+                                 for state, actions in book.items()
+                                 for action, stats in sorted(
+                                     actions.items(), key=lambda item: -win_rate_bounds(item[1])[0])))
+    return write_book(path, ((state, action, 0, 0) for state, action in data.items()))
+
+
+class BinaryBook():
+    """
+    Read-only opening book backed by a memory-mapped book file.
+
+    Supports the dict operations used with pickled books, `state in book`
+    and `book[state]`, for any state symmetric to a book entry; actions are
+    returned in the frame of the state that was looked up. Use open() to
+    share one instance (and one mapping) per file within a process.
+    """
+    _instances = {}
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._count = 0
+
+    @classmethod
+    def open(cls, path=BOOK_FILE):
+        """ Return the shared reader of a book file; the file is not read
+        until the first lookup
+        """
+        path = os.path.abspath(path)
+        if path not in cls._instances:
+            cls._instances[path] = cls(path)
+        return cls._instances[path]
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or size != _RECORD.size:
+            raise ValueError("{} is not a version {} book file".format(self.path, VERSION))
+        self._count = count
+
+    def __len__(self):
+        if self._map is None:
+            self._load()
+        return self._count
+
+    def records(self, state):
+        """
+        Return the (action, visits, wins) records of a state, best first,
+        with the actions in the frame of the given state.
+
+        :param state: Isolation
+        :return: list
+        """
+        if self._map is None:
+            self._load()
+        canonical, transform = canonicalize(state)
+        key = zobrist_hash(canonical)
+        mm, size, base = self._map, _RECORD.size, _HEADER.size
+        lo, hi = 0, self._count
+        while lo < hi:  # find the first record with the key
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<Q", mm, base + mid * size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        board = canonical.board.to_bytes(_BOARD_BYTES, "little")
+        locs = tuple(_NO_LOC if loc is None else loc for loc in canonical.locs)
+        on_opening = canonical.locs[canonical.ply_count % 2] is None
+        results = []
+        for i in range(lo, self._count):
+            record = _RECORD.unpack_from(mm, base + i * size)
+            if record[0] != key:
+                break
+            if record[1] == board and record[2] == canonical.ply_count and record[3:5] == locs:
+                action = record[5] if on_opening else Action(record[5])
+                results.append((inverse_action(action, transform), record[6], record[7]))
+        return results
+
+    def get(self, state, default=None):
+        """ Return the best book action for the state, or default """
+        records = self.records(state)
+        return records[0][0] if records else default
+
+    def __contains__(self, state):
+        return bool(self.records(state))
+
+    def __getitem__(self, state):
+        records = self.records(state)
+        if not records:
+            raise KeyError(state)
+        return records[0][0]
+
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "data.pickle"
+    dst = sys.argv[2] if len(sys.argv) > 2 else BOOK_FILE
+    print("Wrote {} records to {}".format(convert(src, dst), dst))
@@ -10,14 +10,17 @@ import time
 from collections import namedtuple
 from enum import Enum
 from multiprocessing import Process, Queue, Pipe
+from multiprocessing.connection import wait
 from queue import Empty
 
 from .isolation import Isolation, DebugState
 
-__all__ = ['Isolation', 'DebugState', 'Status', 'play', 'fork_get_action']
+__all__ = ['Isolation', 'DebugState', 'Status', 'GameInfo', 'SearchStats', 'play', 'fork_get_action',
+           'AgentWorker']
 logger = logging.getLogger(__name__)
 
 Agent = namedtuple("Agent", "agent_class name")
+GameInfo = namedtuple("GameInfo", "status move_times search_stats")
 
 PROCESS_TIMEOUT = 2  # time to interrupt agent search processes (in seconds)
 GAME_INFO = """\
@@ -51,6 +54,47 @@ class Status(Enum):
 class StopSearch(Exception): pass  # Exception class used to halt search
 
 
+class SearchStats:
+    """ Search statistics for one move.
+
+    The harness gives the agent a new record in agent.stats before each call
+    to get_action() and returns it to the calling process with the agent
+    context. The agent may fill in the search fields as it searches; fields
+    it does not use stay 0. The harness sets budget_ms (the time limit) and
+    time_ms (the time get_action() ran in the agent process).
+
+    Attributes
+    ----------
+    nodes : int
+        number of nodes searched or expanded (for MCTS, one per playout)
+
+    depth : int
+        deepest completed search depth (for MCTS, the deepest leaf selected)
+
+    tt_hits : int
+        number of transposition table probes that found an entry
+
+    iterations : int
+        number of iterations (completed depths, or MCTS playouts)
+    """
+    __slots__ = ("nodes", "depth", "tt_hits", "iterations", "time_ms", "budget_ms")
+
+    def __init__(self, budget_ms=0):
+        self.nodes = 0
+        self.depth = 0
+        self.tt_hits = 0
+        self.iterations = 0
+        self.time_ms = 0.
+        self.budget_ms = budget_ms
+
+    def __repr__(self):
+        return "SearchStats({})".format(", ".join(
+            "{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
 class Countdown_Timer:  # Timer object used to monitor time spent on search
     def __init__(self, time_limit):
         self.__time_limit = time_limit / 1000.
@@ -69,7 +113,7 @@ class Countdown_Timer:  # Timer object used to monitor time spent on search
 def play(args): return _play(*args)  # multithreading ThreadPool.map doesn't expand args
 
 
-def _play(agents, game_state, time_limit, match_id):
+def _play(agents, game_state, time_limit, match_id, persistent_workers=False):
     """ Run a match between two agents by alternately soliciting them to
     select a move and applying it to advance the game state.
 
@@ -87,79 +131,119 @@ def _play(agents, game_state, time_limit, match_id):
         The maximum number of milliseconds to allow before timeout during
         each turn (see notes)
 
+    persistent_workers : bool
+        If True, each agent runs in one AgentWorker process for the whole
+        game; otherwise a new process is forked for every move
+
     Returns
     -------
-    (agent, list<[(int, int),]>, Status)
+    (agent, list<[(int, int),]>, int, GameInfo)
         Return multiple including the winning agent, the actions that
-        were applied to the initial state, a status code describing the
-        reason the game ended, and any error information
+        were applied to the initial state, the match_id, and a GameInfo
+        with the Status describing the reason the game ended, the time
+        in milliseconds each move took, and the SearchStats the agent
+        returned for each move (None if it returned none); the lists
+        include the move that ended the game by timeout, invalid move,
+        or exception
+
+    The game is logged at INFO level (and errors at ERROR level); the
+    messages are only formatted if the logger is enabled for them.
     """
     initial_state = game_state
     game_history = []
+    move_times = []
+    search_stats = []
     winner = None
+    status = Status.GAME_OVER
+    verbose = logger.isEnabledFor(logging.INFO)
     players = [a.agent_class(player_id=i) for i, a in enumerate(agents)]
-    logger.info(GAME_INFO.format(initial_state, *agents))
+    workers = [AgentWorker(p, time_limit) for p in players] if persistent_workers else None
+    if verbose:
+        logger.info(GAME_INFO.format(initial_state, *agents))
     while not game_state.terminal_test():
         active_idx = game_state.ply_count % 2
 
+        start = time.perf_counter()
         try:
-            action = fork_get_action(game_state, players[active_idx], time_limit)
+            if workers:
+                action = workers[active_idx].get_action(game_state)
+            else:
+                action = fork_get_action(game_state, players[active_idx], time_limit)
         except Empty:
-            logger.info(
-                "{} get_action() method did not respond within {} milliseconds".format(
-                    agents[active_idx], time_limit
-            ))
-            logger.info(RESULT_INFO.format(
-                Status.TIMEOUT, game_state, game_history, agents[1 - active_idx], agents[active_idx]
-            ))
-            winner = agents[1 - active_idx]
+            move_times.append(1000 * (time.perf_counter() - start))
+            search_stats.append(players[active_idx].stats)
+            status, winner = Status.TIMEOUT, agents[1 - active_idx]
+            if verbose:
+                logger.info(
+                    "{} get_action() method did not respond within {} milliseconds".format(
+                        agents[active_idx], time_limit
+                ))
+                logger.info(RESULT_INFO.format(
+                    status, game_state, game_history, agents[1 - active_idx], agents[active_idx]
+                ))
             break
         except Exception as err:
+            move_times.append(1000 * (time.perf_counter() - start))
+            search_stats.append(players[active_idx].stats)
+            status, winner = Status.EXCEPTION, agents[1 - active_idx]
             logger.error(ERR_INFO.format(
                 err, initial_state, agents[0], agents[1], game_state, game_history
             ))
-            winner = agents[1 - active_idx]
             break
+        move_times.append(1000 * (time.perf_counter() - start))
+        search_stats.append(players[active_idx].stats)
 
         if action not in game_state.actions():
-            logger.info(RESULT_INFO.format(
-                Status.INVALID_MOVE, game_state, game_history, agents[1 - active_idx], agents[active_idx]
-            ))
-            winner = agents[1 - active_idx]
+            status, winner = Status.INVALID_MOVE, agents[1 - active_idx]
+            if verbose:
+                logger.info(RESULT_INFO.format(
+                    status, game_state, game_history, agents[1 - active_idx], agents[active_idx]
+                ))
             break
 
         game_state = game_state.result(action)
         game_history.append(action)
 
+    for worker in workers or ():  # stop the persistent agent processes
+        worker.close()
+
     if winner is not None:  # Timeout, invalid move, or unknown exception
         pass
     elif game_state.utility(active_idx) > 0:
-        logger.info(RESULT_INFO.format(
-            Status.GAME_OVER, game_state, game_history, agents[active_idx], agents[1 - active_idx]
-        ))
         winner = agents[active_idx]
     elif game_state.utility(1 - active_idx) > 0:
-        logger.info(RESULT_INFO.format(
-            Status.GAME_OVER, game_state, game_history, agents[1 - active_idx], agents[active_idx]
-        ))
         winner = agents[1 - active_idx]
     else:
         raise RuntimeError(("A game ended without a winner.\n" +
             "initial game: {}\nfinal game: {}\naction history: {}\n").format(
                 initial_state, game_state, game_history))
+    if status == Status.GAME_OVER and verbose:
+        logger.info(RESULT_INFO.format(
+            status, game_state, game_history, winner, agents[int(winner == agents[0])]
+        ))
 
-    return winner, game_history, match_id
+    return winner, game_history, match_id, GameInfo(status, move_times, search_stats)
 
 
 def fork_get_action(game_state, active_player, time_limit):
     action_queue = Queue()
     listener, client = Pipe()
     active_player.queue = action_queue  # give the agent instance a threadsafe queue
+    active_player.stats = None  # replaced by the stats of this move if the agent returns them
     
     # comment out these lines for debugging mode
     p = Process(target=_request_action, args=(active_player, game_state, time_limit, client))
     p.start()
-    p.join(timeout=PROCESS_TIMEOUT)
+    client.close()  # the child owns the sending end; recv() raises EOFError if it dies
+    stop_time = time.perf_counter() + PROCESS_TIMEOUT
+    # receive the context before joining; a large context fills the pipe
+    # buffer, and the child cannot exit until the pipe has been drained
+    if listener.poll(PROCESS_TIMEOUT):
+        try:
+            active_player.context, active_player.stats = listener.recv()  # preserve any internal state
+        except EOFError:
+            pass
+    p.join(timeout=max(0, stop_time - time.perf_counter()))
     if p and p.is_alive(): p.terminate()
 
     # Uncomment these lines to run in debug mode, which runs the search function in the
@@ -172,15 +256,131 @@ def fork_get_action(game_state, active_player, time_limit):
     # active_player = deepcopy(active_player)
     # active_player.queue = action_queue
     # _request_action(active_player, game_state, time_limit, client)
+    # active_player.context, active_player.stats = listener.recv()  # preserve any internal state
 
-    if listener.poll():
-        active_player.context = listener.recv()  # preserve any internal state
     while True:  # treat the queue as LIFO
         action = action_queue.get_nowait()  # raises Empty if agent did not respond
         if action_queue.empty(): break
     return action
 
 
+class AgentWorker:
+    """ Long-lived process that runs an agent's get_action() for every move of
+    a game, so that a process is not started for each move.
+
+    Requests (game states) and replies (the agent context) travel over one
+    persistent pipe, and the actions put on agent.queue travel over another,
+    tagged with the request number so that actions from an abandoned request
+    are ignored. The timeout and LIFO semantics match fork_get_action(): the
+    worker has PROCESS_TIMEOUT seconds to reply, and the last action it put
+    on the queue is used. A worker that does not reply in time is terminated,
+    and a new one is started from the last context received.
+
+    Note that, unlike fork_get_action(), attributes other than context that
+    get_action() sets on the agent persist between moves in the worker.
+    """
+    def __init__(self, agent, time_limit):
+        self.agent = agent
+        self.time_limit = time_limit
+        self.request_id = 0
+        self._start()
+
+    def _start(self):
+        self.conn, worker_conn = Pipe()
+        self.actions, worker_actions = Pipe(duplex=False)
+        self.agent.queue = None  # the worker installs its own queue
+        self.process = Process(target=_serve_actions,
+                               args=(self.agent, self.time_limit, worker_conn, worker_actions))
+        self.process.start()
+        worker_conn.close()
+        worker_actions.close()
+
+    def _restart(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        self.actions.close()
+        self._start()
+
+    def get_action(self, game_state):
+        """ Return the last action the agent chose for game_state; raises
+        queue.Empty if the agent did not choose an action in time
+        """
+        self.request_id += 1
+        self.agent.stats = None
+        action, has_action = None, False
+        stop_time = time.perf_counter() + PROCESS_TIMEOUT
+        self.conn.send((self.request_id, game_state))
+        while True:
+            remaining = stop_time - time.perf_counter()
+            ready = wait([self.conn, self.actions], timeout=max(0, remaining))
+            try:
+                while self.actions.poll():  # drain while waiting so that the pipe never fills
+                    request_id, item = self.actions.recv()
+                    if request_id == self.request_id:
+                        action, has_action = item, True
+                if self.conn in ready:
+                    self.agent.context, self.agent.stats = self.conn.recv()  # preserve any internal state
+                    break
+            except EOFError:  # the worker died
+                self._restart()
+                break
+            if remaining <= 0:
+                self._restart()
+                break
+        if not has_action:
+            raise Empty
+        return action
+
+    def close(self):
+        """ Stop the worker process """
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=PROCESS_TIMEOUT)
+        if self.process.is_alive(): self.process.terminate()
+        self.conn.close()
+        self.actions.close()
+
+
+class _TaggedQueue:
+    """ Stand-in for the agent queue in an AgentWorker; put() sends the item
+    to the calling process tagged with the current request number
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.request_id = None
+
+    def put(self, item):
+        self.conn.send((self.request_id, item))
+
+
+def _serve_actions(agent, time_limit, conn, actions):
+    """ Main loop of an AgentWorker process; see _request_action() """
+    timer = Countdown_Timer(time_limit)
+    agent = _wrap_timer(agent, timer)
+    agent.timer = timer
+    agent.queue = _TaggedQueue(actions)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        agent.queue.request_id, game_state = request
+        agent.stats = SearchStats(time_limit)
+        start = time.perf_counter()
+        timer.set_start_time(start)
+        try:
+            agent.get_action(game_state)
+        except StopSearch:
+            pass
+        agent.stats.time_ms = 1000 * (time.perf_counter() - start)
+        conn.send((agent.context, agent.stats))
+
+
 def _callable(member):
     return inspect.ismethod(member) or inspect.isfunction(member)
 
@@ -209,10 +409,14 @@ def _request_action(agent, game_state, time_limit, conn):
     """
     timer = Countdown_Timer(time_limit)
     agent = _wrap_timer(agent, timer)
-    timer.set_start_time(time.perf_counter())
+    agent.timer = timer  # lets the agent budget its own search time
+    agent.stats = SearchStats(time_limit)  # filled in by the agent during its search
+    start = time.perf_counter()
+    timer.set_start_time(start)
     # Catch StopSearch exceptions on timeout, but do not catch other exceptions
     try:
         agent.get_action(game_state)
     except StopSearch:
         pass
-    conn.send(agent.context) # pass updated agent back to calling process
+    agent.stats.time_ms = 1000 * (time.perf_counter() - start)
+    conn.send((agent.context, agent.stats)) # pass updated agent back to calling process
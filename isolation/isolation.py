@@ -33,6 +33,22 @@ class Action(IntEnum):
 
 _ACTIONSET = set(Action)  # used for efficient membership testing
 
+# Precompute the knight-move neighborhood of every board index. _NEIGHBORS[loc]
+# is a bitmask of the on-board cells reachable from loc, and _MOVES[loc] lists
+# the (action, target) pairs for those cells in Action enum order, so that
+# move generation is a single AND against the board followed by a scan of at
+# most eight precomputed pairs.
+_NEIGHBORS = []
+_MOVES = []
+for _loc in range(_SIZE):
+    _pairs = tuple((a, _loc + a) for a in Action
+                   if 0 <= _loc + a < _SIZE and _BLANK_BOARD & (1 << (_loc + a)))
+    _NEIGHBORS.append(sum(1 << target for _, target in _pairs))
+    _MOVES.append(_pairs)
+
+# (cell, bit) pairs for every on-board cell, used to scan an opening board
+_CELL_BITS = tuple((c, 1 << c) for c in range(_SIZE) if _BLANK_BOARD & (1 << c))
+
 
 class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('locs', int)])):
     """ Bitboard implementation of knight's Isolation game state
@@ -74,7 +90,10 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
         loc = self.locs[self.player()]
         if loc is None:
             return self.liberties(loc)
-        return [a for a in Action if (a + loc) >= 0 and (self.board & (1 << (a + loc)))]
+        board = self.board
+        if not board & _NEIGHBORS[loc]:
+            return []
+        return [a for a, target in _MOVES[loc] if board & (1 << target)]
 
     def player(self):
         """ Return the id (zero for first player, one for second player) of player
@@ -112,6 +131,29 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
         locs = (self.locs[0], player_location) if self.player() else (player_location, self.locs[1])
         return Isolation(board=board, ply_count=self.ply_count + 1, locs=locs)
 
+    def outcome(self):
+        """ Return a pair describing whether the game is over and who won
+
+        A single query that replaces calling terminal_test() followed by
+        utility(); each player is checked with one mask test, and the check
+        short-circuits as soon as a player without liberties is found.
+
+        Returns
+        -------
+        (bool, int or None)
+            (True, winner) if either player has no legal moves, where winner
+            is the 0-indexed id of the winning player; otherwise (False, None)
+        """
+        board = self.board
+        active = self.ply_count % 2
+        loc = self.locs[active]
+        if not (board if loc is None else board & _NEIGHBORS[loc]):
+            return True, 1 - active
+        loc = self.locs[1 - active]
+        if not (board if loc is None else board & _NEIGHBORS[loc]):
+            return True, active
+        return False, None
+
     def terminal_test(self):
         """ Return True if either player has no legal moves, otherwise False
 
@@ -120,7 +162,7 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
         bool
             True if either player has no legal moves, otherwise False
         """
-        return not (self._has_liberties(0) and self._has_liberties(1))
+        return self.outcome()[0]
 
     def utility(self, player_id):
         """ Returns the utility of the current game state from the perspective
@@ -144,11 +186,9 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
             a value of -inf if the player has lost, and a value of 0
             otherwise.
         """
-        if not self.terminal_test(): return 0
-        player_id_is_active = (player_id == self.player())
-        active_has_liberties = self._has_liberties(self.player())
-        active_player_wins = (active_has_liberties == player_id_is_active)
-        return float("inf") if active_player_wins else float("-inf")
+        is_terminal, winner = self.outcome()
+        if not is_terminal: return 0
+        return float("inf") if winner == player_id else float("-inf")
 
     def liberties(self, loc):
         """ Return a list of "liberties"--open cells in the neighborhood of `loc`
@@ -165,8 +205,49 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
             A list containing the position of open liberties in the
             neighborhood of the starting position
         """
-        cells = range(_SIZE) if loc is None else (loc + a for a in Action)
-        return [c for c in cells if c >= 0 and self.board & (1 << c)]
+        board = self.board
+        if loc is None:
+            return [c for c, bit in _CELL_BITS if board & bit]
+        if not board & _NEIGHBORS[loc]:
+            return []
+        return [target for _, target in _MOVES[loc] if board & (1 << target)]
+
+    def num_liberties(self, player_id):
+        """ Return the number of liberties available to the specified player
+
+        Equivalent to len(self.liberties(self.locs[player_id])), but counts the
+        open neighbors with a bitmask instead of building a list.
+
+        Parameters
+        ----------
+        player_id : int
+            The 0-indexed id number of the player whose liberties are counted
+
+        Returns
+        -------
+        int
+            The number of open cells the player's token can move into
+        """
+        loc = self.locs[player_id]
+        if loc is None:
+            return self.board.bit_count()
+        return (self.board & _NEIGHBORS[loc]).bit_count()
+
+    def mobility_diff(self, player_id):
+        """ Return the number of liberties available to the specified player
+        minus the number of liberties available to their opponent
+
+        Parameters
+        ----------
+        player_id : int
+            The 0-indexed id number of the player whose perspective is used
+
+        Returns
+        -------
+        int
+            num_liberties(player_id) - num_liberties(1 - player_id)
+        """
+        return self.num_liberties(player_id) - self.num_liberties(1 - player_id)
 
     def _has_liberties(self, player_id):
         """ Return True if the player has any legal moves in the given state
@@ -175,7 +256,8 @@ class Isolation(NamedTuple('Isolation', [('board', int), ('ply_count', int), ('l
         -------
             Isolation.liberties()
         """
-        return any(self.liberties(self.locs[player_id]))
+        loc = self.locs[player_id]
+        return bool(self.board if loc is None else self.board & _NEIGHBORS[loc])
 
 
 class DebugState(Isolation):
@@ -1,9 +1,22 @@
 ## Monte Carlo Tree Search
 
-import random, math, copy
+import random, math, time
+from array import array
+from collections import defaultdict, deque
+from multiprocessing import Pool, TimeoutError
+
+from isolation.isolation import Action, _CELL_BITS, _MOVES, _NEIGHBORS, _SIZE
+from search_board import SearchBoard
+
+try:
+    import numpy as np
+except ImportError:  # batch_rollout() needs NumPy; batch_policy() falls back to rollout()
+    np = None
 
 
 class MCTS_Node():
+    __slots__ = ("visits", "reward", "state", "children", "children_actions", "parent")
+
     def __init__(self, state, parent=None):
         self.visits = 1
         self.reward = 0.0
@@ -17,16 +30,18 @@ class MCTS_Node():
         self.children.append(child)
         self.children_actions.append(action)
 
-    def update(self, reward):
+    def update(self, reward, count=1):
         self.reward += reward
-        self.visits += 1
+        self.visits += count
 
     def fully_explored(self):
         return len(self.children_actions) == len(self.state.actions())
 
 
 FACTOR = 1.0
+_random = random.random  # shares the state (and seed) of the random module
 iter_limit = 100
+MAX_TREE_NODES = 20000  # nodes kept in a search tree that is reused on the next turn
 
 # def mcts(state):
 #     root = MCTS_Node(state)
@@ -88,6 +103,17 @@ def best_child(node):
     return random.choice(best_children)
 
 
+def best_action(root):
+    """
+    Return the action that leads to the best child of the root.
+
+    :param root: MCTS_Node; a node with at least one child
+    :return: action
+    """
+    idx = root.children.index(best_child(root))
+    return root.children_actions[idx]
+
+
 def default_policy(state):
     """
     Randomly search the descendant of the state, and return the reward
@@ -95,29 +121,405 @@ def default_policy(state):
     :param state:
     :return: int
     """
-    init_state = copy.deepcopy(state)
-    while not state.terminal_test():
-        action = random.choice(state.actions())
-        state = state.result(action)
+    init_player = state.player()
+    winner = rollout(state.board, state.locs[0], state.locs[1], state.ply_count)
 
     # let the reward be 1 for the winner, -1 for the loser
-    # if the init_state.player() wins, it means the action that leads to
-    # init_state should be discouraged, so reward = -1.
-    return -1 if state._has_liberties(init_state.player()) else 1
+    # if the init_player wins, it means the action that leads to
+    # the initial state should be discouraged, so reward = -1.
+    return -1 if winner == init_player else 1
+
+
+def rollout(board, loc0, loc1, ply):
+    """
+    Play uniformly random moves from a position to the end of the game and
+    return the id of the winner. Works on the raw fields of an Isolation
+    state: the open cells are found with the precomputed neighbor masks and
+    the move is a randomly selected set bit, so that no states or action
+    lists are created. The game ends as in Isolation.outcome().
+
+    :param board: int; the bitboard of open cells
+    :param loc0: int or None; the location of player 0
+    :param loc1: int or None; the location of player 1
+    :param ply: int; the ply count
+    :return: int; 0 or 1
+    """
+    player = ply & 1
+    loc, other = (loc1, loc0) if player else (loc0, loc1)
+    while True:
+        moves = board if loc is None else board & _NEIGHBORS[loc]
+        if not moves:
+            return 1 - player
+        if other is not None and not board & _NEIGHBORS[other]:
+            return player
+        for _ in range(int(_random() * moves.bit_count())):
+            moves &= moves - 1  # clear the lowest set bit
+        target = moves & -moves
+        board ^= target
+        loc, other = other, target.bit_length() - 1
+        player ^= 1
+
+
+# Batched rollouts: the boards of a batch of games are unpacked into a
+# (games, _BATCH_CELLS) bool array, one column per bit of the bitboard, and
+# the games are advanced in lockstep. _BATCH_TARGETS[loc] lists the cell
+# reached by each of the eight actions from loc, or _BATCH_BLOCKED (a column
+# that is never open) if the action leaves the board.
+_BATCH_BYTES = (_SIZE + 8) // 8
+_BATCH_CELLS = 8 * _BATCH_BYTES
+_BATCH_BLOCKED = _BATCH_CELLS - 1
+if np is not None:
+    _BATCH_TARGETS = np.full((_SIZE, len(Action)), _BATCH_BLOCKED, dtype=np.intp)
+    for _loc, _pairs in enumerate(_MOVES):
+        for _action, _target in _pairs:
+            _BATCH_TARGETS[_loc, list(Action).index(_action)] = _target
+
+
+def batch_rollout(states, rng=None):
+    """
+    Play one uniformly random game from each state, advancing all of the
+    games together with vectorized move generation, and return the id of
+    the winner of each game; the NumPy counterpart of rollout().
+
+    Only the player to move is checked for legal moves: when the opponent is
+    out of moves first, the player to move still wins, one ply later than
+    Isolation.outcome() reports it. Opening moves (players without a
+    location) are played in Python before the games are batched.
+
+    :param states: list of Isolation
+    :param rng: numpy.random.Generator or None
+    :return: numpy array of ints; 0 or 1 for each state
+    """
+    if np is None:
+        raise ImportError("batch_rollout() requires NumPy")
+    rng = np.random.default_rng() if rng is None else rng
+    num_games = len(states)
+    boards = bytearray()
+    first_player = np.empty(num_games, dtype=np.intp)
+    loc = np.empty(num_games, dtype=np.intp)  # location of the player to move
+    other = np.empty(num_games, dtype=np.intp)
+    for i, state in enumerate(states):
+        board, locs, ply = state.board, list(state.locs), state.ply_count
+        while locs[ply & 1] is None:  # place the tokens at random open cells
+            cells = [c for c, bit in _CELL_BITS if board & bit]
+            locs[ply & 1] = cells[rng.integers(len(cells))]
+            board ^= 1 << locs[ply & 1]
+            ply += 1
+        boards += board.to_bytes(_BATCH_BYTES, "little")
+        first_player[i], loc[i], other[i] = ply & 1, locs[ply & 1], locs[1 - (ply & 1)]
+    open_cells = np.unpackbits(np.frombuffer(bytes(boards), dtype=np.uint8),
+                               bitorder="little").astype(bool)  # games * _BATCH_CELLS flat
+
+    winners = np.empty(num_games, dtype=np.intp)
+    games = np.arange(num_games)
+    offsets = games * _BATCH_CELLS  # index of the first cell of each game in open_cells
+    ply = 0  # the games advance in lockstep, so the player to move alternates for all
+    while len(games):
+        targets = _BATCH_TARGETS[loc]
+        legal = open_cells[offsets[:, None] + targets]
+        # the legal action with the highest random priority is a uniform choice
+        priority = rng.random(legal.shape)
+        priority[~legal] = -1.
+        choice = priority.argmax(axis=1)
+        rows = np.arange(len(games))
+        alive = legal[rows, choice]
+        if not alive.all():  # the player to move has no legal actions and loses
+            over = games[~alive]
+            winners[over] = 1 - (first_player[over] ^ (ply & 1))
+            games, offsets, targets, choice, other = \
+                games[alive], offsets[alive], targets[alive], choice[alive], other[alive]
+            rows = rows[:len(games)]
+        target = targets[rows, choice]
+        open_cells[offsets + target] = False
+        loc, other = other, target
+        ply += 1
+    return winners
+
+
+def batch_policy(state, num_rollouts, rng=None):
+    """
+    Return the total reward of num_rollouts random playouts from the state,
+    i.e., the sum of num_rollouts calls to default_policy(state); the
+    playouts are batched with batch_rollout() if NumPy is installed.
+
+    :param state: Isolation
+    :param num_rollouts: int
+    :param rng: numpy.random.Generator or None
+    :return: int
+    """
+    if np is None:
+        return sum(default_policy(state) for _ in range(num_rollouts))
+    wins = int(np.count_nonzero(batch_rollout([state] * num_rollouts, rng) == state.player()))
+    return num_rollouts - 2 * wins
+
+
+def reuse_subtree(old_root, state, max_plies=2):
+    """
+    Find the node of a previous search tree whose state is the current state,
+    e.g., two plies down after our move and the opponent's reply.
+    The node is detached from its parent so that the rest of the old tree
+    can be garbage collected.
+
+    :param old_root: MCTS_Node; root of the previous search
+    :param state: Isolation; the current state
+    :param max_plies: int; depth of the old tree to look through
+    :return: MCTS_Node or None
+    """
+    frontier = [old_root]
+    for _ in range(max_plies + 1):
+        for node in frontier:
+            if node.state == state:
+                node.parent = None
+                return node
+        frontier = [child for node in frontier for child in node.children]
+    return None
 
 
-def backup(node, reward):
+def prune(root, max_nodes=MAX_TREE_NODES):
+    """
+    Limit the size of a tree to max_nodes, keeping the shallowest nodes and,
+    among siblings, the most visited ones. Removed children are also removed
+    from children_actions so that they can be expanded again.
+
+    :param root: MCTS_Node
+    :param max_nodes: int
+    :return: int; the number of nodes kept
+    """
+    kept = 1
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        keep = max(0, min(len(node.children), max_nodes - kept))
+        if keep < len(node.children):
+            by_visits = sorted(range(len(node.children)), key=lambda i: -node.children[i].visits)
+            idx = sorted(by_visits[:keep])
+            node.children = [node.children[i] for i in idx]
+            node.children_actions = [node.children_actions[i] for i in idx]
+        kept += keep
+        queue.extend(node.children)
+    return kept
+
+
+def backup(node, reward, count=1):
     """
     Backpropagation
     Use the result to update information in the nodes on the path.
 
     :param node:
-    :param reward: int
+    :param reward: int; the total reward of the playouts
+    :param count: int; the number of playouts
     :return:
     """
     while node != None:
-        node.update(reward)
+        node.update(reward, count)
         node = node.parent
         reward *= -1
 
 
+
+
+class MCTS_Tree():
+    """
+    Search tree stored in parallel arrays indexed by node number, a compact
+    alternative to linked MCTS_Node objects. Node 0 is the root.
+
+    The children of a node are allocated together, one for each legal action
+    in the order of state.actions(), the first time the node is expanded, so
+    they have consecutive numbers starting at first_child[node]. The first
+    num_tried[node] of them have been added to the tree; the rest are the
+    untried actions. States are not stored: select() replays the actions
+    from the root state on a SearchBoard.
+    """
+    def __init__(self, state):
+        self.state = state
+        self.board = SearchBoard(state)
+        self.visits = array('l', [1])
+        self.reward = array('d', [0.0])
+        self.parent = array('l', [-1])
+        self.first_child = array('l', [-1])  # -1 until the node is expanded
+        self.num_children = array('B', [0])
+        self.num_tried = array('B', [0])
+        self.action = array('b', [0])  # the action leading to the node
+
+    def __len__(self):
+        return len(self.visits)
+
+    def _allocate(self, node, actions):
+        """ Add a block of children to node, one for each action
+
+        :return: int; the number of the first child
+        """
+        first, count = len(self.visits), len(actions)
+        self.visits.extend([1] * count)
+        self.reward.extend([0.0] * count)
+        self.parent.extend([node] * count)
+        self.first_child.extend([-1] * count)
+        self.num_children.extend([0] * count)
+        self.num_tried.extend([0] * count)
+        self.action.extend(actions)
+        self.first_child[node] = first
+        self.num_children[node] = count
+        return first
+
+    def _action(self, state, node):
+        """ Return the action leading from state to the given child node """
+        action = self.action[node]
+        return action if state.locs[state.player()] is None else Action(action)
+
+    def select(self):
+        """
+        Tree policy: descend from the root through the best children and
+        add the first untried child of the first node that has one.
+
+        :return: (int, SearchBoard); the selected node and its position,
+            which is valid until the next call
+        """
+        board, action = self.board, self.action
+        while board.depth():
+            board.pop()
+        node = 0
+        while not board.terminal_test():
+            first = self.first_child[node]
+            if first < 0:
+                first = self._allocate(node, board.actions())
+            tried = self.num_tried[node]
+            if tried < self.num_children[node]:
+                self.num_tried[node] = tried + 1
+                board.push(action[first + tried])
+                return first + tried, board
+            node = self.best_child(node)
+            board.push(action[node])
+        return node, board
+
+    def best_child(self, node):
+        """
+        Find the tried child of a node with the best score.
+
+        :param node: int
+        :return: int
+        """
+        visits, reward = self.visits, self.reward
+        log_visits = math.log(visits[node])
+        best_score = float("-inf")
+        best_children = []
+        first = self.first_child[node]
+        for child in range(first, first + self.num_tried[node]):
+            score = reward[child] / visits[child] + FACTOR * math.sqrt(2.0 * log_visits / visits[child])
+            if score == best_score:
+                best_children.append(child)
+            elif score > best_score:
+                best_children = [child]
+                best_score = score
+        return random.choice(best_children)
+
+    def best_action(self):
+        """ Return the action that leads to the best child of the root """
+        return self._action(self.state, self.best_child(0))
+
+    def backup(self, node, reward, count=1):
+        """
+        Backpropagation from node to the root.
+
+        :param node: int
+        :param reward: int; the total reward of the playouts
+        :param count: int; the number of playouts
+        """
+        visits, total, parent = self.visits, self.reward, self.parent
+        while node >= 0:
+            total[node] += reward
+            visits[node] += count
+            node = parent[node]
+            reward *= -1
+
+    def subtree(self, state, max_plies=2, max_nodes=MAX_TREE_NODES):
+        """
+        Copy the part of the tree below the node whose state is the current
+        state into a new tree, keeping at most max_nodes nodes; the
+        equivalent of reuse_subtree() followed by prune(). Children blocks
+        are copied whole, shallowest first.
+
+        :param state: Isolation; the current state
+        :param max_plies: int; depth of the tree to look through
+        :param max_nodes: int
+        :return: MCTS_Tree or None
+        """
+        match, frontier = None, [(0, self.state)]
+        for _ in range(max_plies + 1):
+            match = next((node for node, s in frontier if s == state), None)
+            if match is not None:
+                break
+            frontier = [(child, s.result(self._action(s, child)))
+                        for node, s in frontier if self.first_child[node] >= 0
+                        for child in range(self.first_child[node],
+                                           self.first_child[node] + self.num_tried[node])]
+        if match is None:
+            return None
+
+        tree = MCTS_Tree(state)
+        tree.visits[0], tree.reward[0] = self.visits[match], self.reward[match]
+        queue = deque([(match, 0)])
+        while queue:
+            old, node = queue.popleft()
+            first, count = self.first_child[old], self.num_children[old]
+            if first < 0 or len(tree) + count > max_nodes:
+                continue
+            new_first = tree._allocate(node, self.action[first:first + count])
+            tree.visits[new_first:] = self.visits[first:first + count]
+            tree.reward[new_first:] = self.reward[first:first + count]
+            tree.num_tried[node] = self.num_tried[old]
+            queue.extend((first + i, new_first + i) for i in range(self.num_tried[old]))
+        return tree
+
+
+def root_parallel_search(state, processes, deadline=None, stop_time=None, playouts=iter_limit,
+                         rollouts_per_leaf=1):
+    """
+    Root-parallel MCTS: each of `processes` worker processes grows an
+    independent MCTS_Tree from the state, and the visit counts of the root
+    actions are summed over the trees to choose the most visited action.
+
+    :param state: Isolation
+    :param processes: int; the number of worker processes
+    :param deadline: float or None; time.perf_counter() value at which the
+        workers stop their playouts; without one they run `playouts` each
+    :param stop_time: float or None; time.perf_counter() value after which
+        the results of the workers are abandoned
+    :param playouts: int; the playouts per worker when deadline is None
+    :param rollouts_per_leaf: int; see batch_policy()
+    :return: (action, dict, int) or None; the most visited action, the
+        summed visits of every root action and the total number of
+        playouts, or None if the workers did not finish before stop_time
+    """
+    with Pool(processes) as pool:
+        task = pool.map_async(_grow_root, [(state, deadline, playouts, rollouts_per_leaf)] * processes)
+        try:
+            results = task.get(None if stop_time is None else max(0., stop_time - time.perf_counter()))
+        except TimeoutError:
+            return None
+    visits = defaultdict(int)
+    for _, root_visits in results:
+        for action, count in root_visits:
+            visits[action] += count
+    if not visits:
+        return None
+    return max(visits, key=visits.get), dict(visits), sum(r[0] for r in results)
+
+
+def _grow_root(args):
+    """ Worker of root_parallel_search(): run playouts on a new tree, and
+    return the number of playouts and the (action, visits) pairs of the root
+    """
+    state, deadline, playouts, rollouts_per_leaf = args
+    tree = MCTS_Tree(state)
+    rng = np.random.default_rng() if np is not None and rollouts_per_leaf > 1 else None
+    iterations = 0
+    while iterations < playouts and (deadline is None or time.perf_counter() < deadline):
+        node, leaf = tree.select()
+        if rollouts_per_leaf > 1:
+            tree.backup(node, batch_policy(leaf, rollouts_per_leaf, rng), rollouts_per_leaf)
+        else:
+            tree.backup(node, default_policy(leaf))
+        iterations += 1
+    first = tree.first_child[0]
+    return iterations, [(tree._action(state, child), tree.visits[child] - 1)
+                        for child in range(first, first + tree.num_tried[0])]
@@ -1,10 +1,20 @@
 from sample_players import DataPlayer
 from mcts import *
 from _utils import *
+from opening_book import lookup
+from transposition import TranspositionTable
+import logging
 import random
+import time
+
+logger = logging.getLogger(__name__)
 
 class CustomPlayer_MiniMax(DataPlayer):
     """ Implement customized agent to play knight's Isolation """
+    depth_limit = 5  # search depth used when no timer is available
+    search_mode = "alphabeta"  # or "pvs"; see _utils.SEARCH_MODES
+    processes = 1  # >1 splits the root moves across that many worker processes
+    incremental = True  # search on a SearchBoard with push/pop instead of Isolation.result()
 
     def get_action(self, state):
         """ Employ an adversarial search technique to choose an action
@@ -24,16 +34,43 @@ class CustomPlayer_MiniMax(DataPlayer):
         **********************************************************************
         """
         if state.ply_count < 4:
-            if state in self.data:
-                self.queue.put(self.data[state])
+            action = lookup(self.data, state) if self.data else None
+            if action is not None:
+                self.queue.put(action)
             else:
                 self.queue.put(random.choice(state.actions()))
         else:
             ###### iterative deepening ######
-            depth_limit = 5
-            for depth in range(1, depth_limit + 1):
-                best_move = alpha_beta_search(state, self.player_id, depth)
-            self.queue.put(best_move)
+            # publish a legal fallback move first, then the best move after
+            # every completed depth; without a timer (e.g., in debug mode)
+            # search to a fixed depth instead
+            self.queue.put(random.choice(state.actions()))
+            if self.timer is None:
+                time_left, max_depth = None, self.depth_limit
+            else:
+                time_left, max_depth = self.timer.check_time(), None
+            if self.processes > 1:
+                # the shared table lives for one move; it cannot be pickled into self.context
+                reports = parallel_iterative_deepening(state, self.player_id, self.queue.put,
+                                                       time_left, max_depth, self.processes,
+                                                       incremental=self.incremental)
+            else:
+                # the transposition table is carried between turns in self.context
+                if self.context is None:
+                    self.context = TranspositionTable()
+                self.context.new_search()
+                hits = self.context.hits
+                reports = iterative_deepening(state, self.player_id, self.queue.put,
+                                              time_left, self.context, max_depth, MoveOrdering(),
+                                              self.search_mode, self.incremental)
+                self.stats.tt_hits = self.context.hits - hits
+            # the nodes of a depth abandoned at the deadline are not reported
+            self.stats.nodes = sum(r.nodes for r in reports)
+            self.stats.depth = reports[-1].depth if reports else 0
+            self.stats.iterations = len(reports)
+            for r in reports:
+                logger.debug("depth {} nodes {} time {:.1f}ms ebf {:.2f} move {} score {}".format(
+                    r.depth, r.nodes, 1000 * r.elapsed, r.ebf, r.move, r.score))
 
             #### no iterative deepening ####
             # self.queue.put(alpha_beta_search(state,self.player_id))
@@ -44,25 +81,102 @@ class CustomPlayer_MCTS(DataPlayer):
     """
     Implement an agent to play knight's Isolation with Monte Carlo Tree Search
     """
+    time_fraction = 0.8  # fraction of the time left for the move spent on playouts
+    publish_interval = 50  # playouts between publishing the current best root move
+    compact_tree = True  # store the tree in an array-backed MCTS_Tree instead of MCTS_Node objects
+    rollouts_per_leaf = 1  # playouts from each new leaf; more than one are batched (see batch_policy)
+    processes = 1  # >1 grows an independent tree in each of that many worker processes
+    time_margin = 20  # milliseconds kept in reserve to collect the results of parallel workers
+    playouts = iter_limit  # playouts per search when no timer is available (e.g., in debug mode)
 
     def mcts(self, state):
-        root = MCTS_Node(state)
-        if root.state.terminal_test():
+        if self.processes > 1:
+            return self.parallel_mcts(state)
+
+        # continue from the subtree of the previous search (kept in
+        # self.context) that matches the current state, if there is one
+        if self.compact_tree:
+            tree = self.context.subtree(state) if isinstance(self.context, MCTS_Tree) else None
+            if tree is None:
+                tree = MCTS_Tree(state)
+            select, update, choose = tree.select, tree.backup, tree.best_action
+        else:
+            root = reuse_subtree(self.context, state) if isinstance(self.context, MCTS_Node) else None
+            if root is None:
+                root = MCTS_Node(state)
+            tree = root
+            update, choose = backup, lambda: best_action(root)
+
+            def select():
+                child = tree_policy(root)
+                return child, child.state
+        self.context = None
+        if state.terminal_test():
             return random.choice(state.actions())
-        for _ in range(iter_limit):
-            child = tree_policy(root)
-            if not child:
-                continue
-            reward = default_policy(child.state)
-            backup(child, reward)
 
-        idx = root.children.index(best_child(root))
-        return root.children_actions[idx]
+        # run playouts until the time budget is spent; without a timer
+        # (e.g., in debug mode) run a fixed number of playouts instead
+        start = time.perf_counter()
+        if self.timer is None:
+            deadline, max_iterations = None, self.playouts
+        else:
+            deadline = start + self.time_fraction * self.timer.check_time() / 1000.
+            max_iterations = float("inf")
+        # numpy does not reseed its generators in forked processes, so make one per search
+        rng = np.random.default_rng() if np is not None and self.rollouts_per_leaf > 1 else None
+        iterations = max_ply = 0
+        while iterations < max_iterations and (deadline is None or time.perf_counter() < deadline):
+            node, leaf = select()
+            iterations += 1
+            if leaf.ply_count > max_ply:
+                max_ply = leaf.ply_count
+            if self.rollouts_per_leaf > 1:
+                update(node, batch_policy(leaf, self.rollouts_per_leaf, rng), self.rollouts_per_leaf)
+            else:
+                update(node, default_policy(leaf))
+            if iterations % self.publish_interval == 0:
+                self.queue.put(choose())
+                self.stats.nodes = self.stats.iterations = iterations
+        self.stats.nodes = self.stats.iterations = iterations
+        self.stats.depth = max(max_ply - state.ply_count, 0)
+        elapsed = time.perf_counter() - start
+        logger.debug("mcts iterations {} in {:.1f}ms ({:.0f}/sec)".format(
+            iterations, 1000 * elapsed, iterations / elapsed if elapsed else float("inf")))
+
+        if not self.compact_tree:
+            prune(root, MAX_TREE_NODES)  # MCTS_Tree.subtree() prunes when the tree is reused
+        self.context = tree
+        return choose()
+
+    def parallel_mcts(self, state):
+        # root-parallel search; the worker trees are not kept between turns
+        self.context = None
+        start = time.perf_counter()
+        if self.timer is None:
+            deadline = stop_time = None
+            playouts = self.playouts
+        else:
+            time_left = self.timer.check_time()
+            deadline = start + self.time_fraction * time_left / 1000.
+            stop_time = start + (time_left - self.time_margin) / 1000.
+            playouts = float("inf")
+        result = root_parallel_search(state, self.processes, deadline, stop_time, playouts,
+                                      self.rollouts_per_leaf)
+        if result is None:
+            logger.debug("mcts workers did not finish in time")
+            return random.choice(state.actions())
+        action, visits, iterations = result
+        self.stats.nodes = self.stats.iterations = iterations
+        elapsed = time.perf_counter() - start
+        logger.debug("mcts iterations {} on {} processes in {:.1f}ms ({:.0f}/sec)".format(
+            iterations, self.processes, 1000 * elapsed, iterations / elapsed if elapsed else float("inf")))
+        return action
 
     def get_action(self, state):
         if state.ply_count < 2:
             self.queue.put(random.choice(state.actions()))
         else:
+            self.queue.put(random.choice(state.actions()))  # fallback until a playout finishes
             self.queue.put(self.mcts(state))
 
 
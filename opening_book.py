@@ -1,56 +1,304 @@
 # develop an opening book of the best moves for every possible game state
 # from an empty board to at least a depth of 4 plies
 
+import argparse
+import os
 import time
+import textwrap
 import random, pickle
-from collections import defaultdict, Counter
+import math
+from collections import defaultdict, namedtuple
+from multiprocessing import Pool
 
 from isolation import Isolation
-from isolation.isolation import _WIDTH, _HEIGHT,_ACTIONSET,Action
 from _utils import *
+from mcts import rollout
+from symmetry import (LR, UD, LRUD, TRANSFORMS, canonicalize, inverse_action, transform_action,
+                      transform_loc, transform_state)
 
 
 
+# The book statistics are kept per (canonical state, action): book[state] maps
+# each action tried in the state to its ActionStats, the number of simulations
+# through the action and how many of them the player to move won.
+ActionStats = namedtuple("ActionStats", "visits wins")
+_NO_STATS = ActionStats(0, 0)
+
+CONFIDENCE_Z = 1.96  # z-score of the confidence bounds on the win rate of an action
+UCB_C = math.sqrt(2)  # exploration constant of the UCT book generator
+
+
+def new_book():
+    return defaultdict(dict)
+
+
+def record(book, state, action, reward):
+    """ Add one simulation result for taking action in state; reward is 1
+    if the player to move in state won, -1 otherwise
+    """
+    # symmetric states share one entry, keyed by the canonical state
+    canonical, transform = canonicalize(state)
+    action = transform_action(action, transform)
+    stats = book[canonical].get(action, _NO_STATS)
+    book[canonical][action] = ActionStats(stats.visits + 1, stats.wins + (reward > 0))
+
+
+def win_rate_bounds(stats, z=CONFIDENCE_Z):
+    """ Return the (lower, upper) Wilson score interval of the win rate """
+    n = stats.visits
+    if not n:
+        return 0., 1.
+    p = stats.wins / n
+    center = p + z * z / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return (center - spread) / (1 + z * z / n), (center + spread) / (1 + z * z / n)
+
+
+def best_action(actions):
+    """ Return the action with the highest lower confidence bound on its win
+    rate, from a dict of action -> ActionStats
+    """
+    return max(actions, key=lambda a: win_rate_bounds(actions[a])[0])
+
+
+def best_actions(book, min_visits=1):
+    """ Return the state -> action table of the best actions (see
+    best_action()) of the states simulated at least min_visits times
+    """
+    return {k: best_action(v) for k, v in book.items()
+            if sum(s.visits for s in v.values()) >= min_visits}
+
+
 def build_table(num_rounds=20):
     # Builds a table that maps from game state -> action
-    # by choosing the action that accumulates the most
-    # wins for the active player. (Note that this uses
-    # raw win counts, which are a poor statistic to
-    # estimate the value of an action; better statistics
-    # exist.)
+    # by choosing the action with the best lower
+    # confidence bound on its win rate.
 
-    book = defaultdict(Counter)
+    book = new_book()
     for i in range(num_rounds):
-        state = Isolation()
-        print(i)
-        print(state.board,bin(state.board))
-        build_tree(state, book)
-    return {k: max(v, key=v.get) for k, v in book.items()}
+        build_tree(Isolation(), book)
+    return best_actions(book)
 
 
 def build_tree(state, book, depth=4):
     if depth <= 0 or state.terminal_test():
         return -simulate(state)
-    action = alpha_beta_search(state)
+    action = alpha_beta_search(state, state.player())
     reward = build_tree(state.result(action), book, depth - 1)
+    record(book, state, action, reward)
+    return -reward
 
-    sym_states_type = symmetric_states(state)
-    sym_states = [sym_state[0] for sym_state in sym_states_type]
-    for i,sym_state in enumerate(sym_states):
-        if sym_state in book.keys():
-            sym_type = sym_states_type[i][1]
-            sym_action = symmetric_action(action, sym_type)
-            book[sym_state][sym_action] += reward
-            break
-    book[state][action] += reward
 
+def sample_tree(state, book, depth=4):
+    """ Like build_tree(), but play a uniformly random line of play """
+    if depth <= 0 or state.terminal_test():
+        return -simulate(state)
+    action = random.choice(state.actions())
+    reward = sample_tree(state.result(action), book, depth - 1)
+    record(book, state, action, reward)
+    return -reward
+
+
+def uct_tree(state, book, depth=4):
+    """ Like build_tree(), but choose the moves with UCB1 over the book
+    statistics, trying every action of a state once (in random order)
+    before choosing by upper confidence bound, so that simulations are
+    spent on the most promising openings
+    """
+    if depth <= 0 or state.terminal_test():
+        return -simulate(state)
+    canonical, transform = canonicalize(state)
+    stats = book.get(canonical, {})
+    actions = state.actions()
+    untried = [a for a in actions if transform_action(a, transform) not in stats]
+    if untried:
+        action = random.choice(untried)
+    else:
+        log_visits = math.log(sum(s.visits for s in stats.values()))
+
+        def ucb(a):
+            s = stats[transform_action(a, transform)]
+            return s.wins / s.visits + UCB_C * math.sqrt(log_visits / s.visits)
+        action = max(actions, key=ucb)
+    reward = uct_tree(state.result(action), book, depth - 1)
+    record(book, state, action, reward)
     return -reward
 
 
 def simulate(state):
-    while not state.terminal_test():
-        state = state.result(random.choice(state.actions()))
-    return -1 if state.utility(state.player()) < 0 else 1
+    winner = rollout(state.board, state.locs[0], state.locs[1], state.ply_count)
+    return 1 if winner == state.player() else -1
+
+
+def convergence_report(book, previous=None, min_visits=100):
+    """
+    Summarize how settled the book is.
+
+    :param book: the book statistics
+    :param previous: dict or None; a best_actions() table from earlier
+    :param min_visits: int; the states counted must have this many visits
+    :return: (dict, dict); the report and the best_actions() table of the
+        states counted, to pass as previous to the next report. The report
+        has the number of simulations (visits of the empty board), the
+        number of states counted, the fraction of them whose best action is
+        separated (its lower confidence bound is above the upper bound of
+        every other action), the fraction whose best action differs from
+        previous, and the best root action with its visits and win rate
+        bounds
+    """
+    root_stats = book.get(Isolation(), {})
+    report = {"simulations": sum(s.visits for s in root_stats.values())}
+    table = best_actions(book, min_visits)
+    separated = 0
+    for state, action in table.items():
+        lower = win_rate_bounds(book[state][action])[0]
+        if all(win_rate_bounds(s)[1] < lower for a, s in book[state].items() if a != action):
+            separated += 1
+    report["states"] = len(table)
+    report["separated"] = separated / len(table) if table else 0.
+    if previous is not None:
+        common = [s for s in table if s in previous]
+        report["changed"] = sum(table[s] != previous[s] for s in common) / len(common) if common else 0.
+    if root_stats:
+        action = best_action(root_stats)
+        report["root_action"] = action
+        report["root_visits"] = root_stats[action].visits
+        report["root_bounds"] = win_rate_bounds(root_stats[action])
+    return report, table
+
+
+
+
+###################################################################
+###################  parallel, resumable builder  #################
+###################################################################
+BOOK_DEPTH = 4  # number of plies covered by the book
+BATCH_SIZE = 1000  # simulations in each task sent to a worker process
+CHECKPOINT_INTERVAL = 60  # seconds between checkpoints
+CHECKPOINT_VERSION = 2
+SHARED_PLIES = 2  # UCT workers start from the merged statistics of states before this ply
+METHODS = {"uniform": sample_tree, "uct": uct_tree}
+
+
+def build_book(num_simulations, depth=BOOK_DEPTH, processes=None, checkpoint=None, seed=0,
+               batch_size=BATCH_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL, method="uniform",
+               progress=None):
+    """
+    Build the statistics of an opening book by simulating lines of play in
+    a pool of worker processes; method is "uniform" (random lines, see
+    sample_tree()) or "uct" (see uct_tree()).
+
+    The simulations are split into batches of batch_size, and batch i is
+    seeded from (seed, i). Batches run in rounds of one batch per process.
+    For "uct", each batch of a round starts from the statistics merged at
+    the end of the previous round for the states before SHARED_PLIES, and
+    grows its own statistics for the later states. A book depends only on
+    its settings and the number of processes.
+
+    If a checkpoint path is given, the book and the set of finished batches
+    are saved there at the end of a round once every checkpoint_interval
+    seconds, and at the end; a build with the same settings resumes from an
+    existing checkpoint. progress(book) is called at the same times.
+
+    :param num_simulations: int; rounded up to a whole number of batches
+    :param depth: int; the number of plies covered by the book
+    :param processes: int or None; the pool size (default: the CPU count)
+    :param checkpoint: str or None; the checkpoint file path
+    :return: canonical state -> action -> ActionStats
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method {!r}; choose from {}".format(method, list(METHODS)))
+    num_batches = -(-num_simulations // batch_size)
+    settings = {"seed": seed, "depth": depth, "batch_size": batch_size, "method": method}
+    book, done = new_book(), set()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        saved = load_checkpoint(checkpoint)
+        if saved["settings"] != settings:
+            raise ValueError("Checkpoint {} was built with {}, not {}".format(
+                checkpoint, saved["settings"], settings))
+        book, done = saved["book"], saved["done"]
+    pending = [i for i in range(num_batches) if i not in done]
+    round_size = processes or os.cpu_count() or 1
+
+    last_save = time.time()
+    with Pool(processes) as pool:
+        for start in range(0, len(pending), round_size):
+            shared = {}
+            if method == "uct":
+                shared = {s: dict(v) for s, v in book.items() if s.ply_count < SHARED_PLIES}
+            tasks = [(i, seed, depth, batch_size, method, shared)
+                     for i in pending[start:start + round_size]]
+            for index, table in pool.imap_unordered(_simulate_batch, tasks):
+                merge_books(book, table)
+                done.add(index)
+            if time.time() - last_save > checkpoint_interval:
+                if checkpoint is not None:
+                    save_checkpoint(checkpoint, book, done, settings)
+                if progress is not None:
+                    progress(book)
+                last_save = time.time()
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, book, done, settings)
+    if progress is not None:
+        progress(book)
+    return book
+
+
+def _simulate_batch(args):
+    """ Worker of build_book(): run one batch of simulations, and return
+    the statistics they added
+    """
+    index, seed, depth, batch_size, method, shared = args
+    random.seed((seed << 32) | index)
+    book = merge_books(new_book(), shared)
+    for _ in range(batch_size):
+        METHODS[method](Isolation(), book, depth)
+    return index, merge_books(book, shared, -1)
+
+
+def merge_books(book, other, sign=1):
+    """ Add (or with sign=-1, subtract) the statistics of other into book,
+    dropping actions left without visits; return book
+    """
+    for state, actions in other.items():
+        stats = book[state]
+        for action, s in actions.items():
+            old = stats.get(action, _NO_STATS)
+            new = ActionStats(old.visits + sign * s.visits, old.wins + sign * s.wins)
+            if new.visits:
+                stats[action] = new
+            else:
+                del stats[action]
+        if not stats:
+            del book[state]
+    return book
+
+
+def save_checkpoint(path, book, done, settings=None):
+    """ Write a book and the finished batches to path; the file is replaced
+    atomically, so an interrupted write keeps the last checkpoint
+    """
+    # plain tuples, so that the file does not depend on where ActionStats is defined
+    data = {"version": CHECKPOINT_VERSION, "settings": settings, "done": set(done),
+            "book": {s: {a: tuple(st) for a, st in v.items()} for s, v in book.items()}}
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path):
+    """ Return the checkpoint saved at path, with the book as returned by
+    build_book()
+    """
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    if data.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version in {}".format(path))
+    book = new_book()
+    for state, actions in data["book"].items():
+        book[state] = {a: ActionStats._make(st) for a, st in actions.items()}
+    data["book"] = book
+    return data
 
 
 
@@ -58,68 +306,118 @@ def simulate(state):
 ###################################################################
 ###################  symmetries in opening book   #################
 ###################################################################
+# see the symmetry module; the sym_type strings are its transform names
+
 def symmetric_positions(position, sym_type):
-    row, col = position // (_WIDTH+2), position % (_WIDTH + 2)
-    if sym_type == 'LR':
-        return row * (_WIDTH+2) + (_WIDTH+1-col)
-    elif sym_type == 'UD':
-        return (_HEIGHT-1-row) * (_WIDTH+2) + col
-    elif sym_type == 'LRUD':
-        return (_HEIGHT-1-row) * (_WIDTH+2) + (_WIDTH+1-col)
+    return transform_loc(position, sym_type)
 
 
 def symmetric_states(state):
     """  return the states symmetric to the current one   """
-    board = bin(state.board)[2:]
-    board = [board[i*(_WIDTH+2):(i+1)*(_WIDTH+2)] for i in range(_HEIGHT)]
+    return [(transform_state(state, sym_type), sym_type) for sym_type in (LR, UD, LRUD)]
 
-    # left - right:
-    board_1 = eval('0b'+''.join([row[::-1] for row in board]))
-    locs_1 = (symmetric_positions(state.locs[0],'LR') if state.locs[0] != None else None,symmetric_positions(state.locs[1],'LR') if state.locs[1] != None else None)
-    state_1 = Isolation(board_1, ply_count=state.ply_count, locs=locs_1)
-    # up - down:
-    board_2 = eval('0b'+''.join(board[::-1]))
-    locs_2 = (symmetric_positions(state.locs[0],'UD') if state.locs[0] != None else None,symmetric_positions(state.locs[1],'UD') if state.locs[1] != None else None)
-    state_2 = Isolation(board_2, ply_count=state.ply_count, locs=locs_2)
 
-    # left - right and up - down:
-    board_3 = eval('0b'+''.join([row[::-1] for row in board[::-1]]))
-    locs_3 = (symmetric_positions(state.locs[0],'LRUD') if state.locs[0] != None else None,symmetric_positions(state.locs[1],'LRUD') if state.locs[1] != None else None)
-    state_3 = Isolation(board_3, ply_count=state.ply_count, locs=locs_3)
+def symmetric_action(action, sym_type):
+    """ return the symmetric action according to the symmetry type sym_type """
+    if sym_type not in TRANSFORMS:
+        raise ValueError(" The value of sym_type is illegal")
+    return transform_action(action, sym_type)
 
-    return [(state_1,'LR'),(state_2,'UD'),(state_3,'LRUD')]
 
+def lookup(book, state):
+    """ Return the book action for a state, or None if it is not in the book.
+    Books are keyed by canonical states (see symmetry.canonicalize); books
+    built before that are keyed by the states themselves.
+    """
+    if state in book:
+        return book[state]
+    canonical, transform = canonicalize(state)
+    if canonical in book:
+        return inverse_action(book[canonical], transform)
+    return None
 
-sym_dict_LR = {Action.NNE:Action.NNW,Action.ENE:Action.WNW,Action.ESE:Action.WSW,Action.SSE:Action.SSW,Action.SSW:Action.SSE,Action.WSW:Action.ESE,Action.WNW:Action.ENE,Action.NNW:Action.NNE}
-sym_dict_UD = {Action.NNE:Action.SSE,Action.ENE:Action.ESE,Action.ESE:Action.ENE,Action.SSE:Action.NNE,Action.SSW:Action.NNW,Action.WSW:Action.WNW,Action.WNW:Action.WSW,Action.NNW:Action.SSW}
-sym_dict_LRUD = {Action.NNE:Action.SSW,Action.ENE:Action.WSW,Action.ESE:Action.WNW,Action.SSE:Action.NNW,Action.SSW:Action.NNE,Action.WSW:Action.ENE,Action.WNW:Action.ESE,Action.NNW:Action.SSE}
 
-def symmetric_action(action, sym_type):
-    """ return the symmetric action according to the symmetry type sym_type """
 
-    if action not in _ACTIONSET:
-        return symmetric_positions(action,sym_type)
-    elif sym_type == 'LR':
-        return sym_dict_LR[action]
-    elif sym_type == 'UD':
-        return sym_dict_UD[action]
-    elif sym_type == 'LRUD':
-        return sym_dict_LRUD[action]
-    else:
-        raise ValueError(" The value of sym_type is illegal")
 
 
+NUM_SIMULATIONS = 100000
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Build an opening book by simulating random lines of play.",
+        epilog=textwrap.dedent("""\
+            Example Usage:
+            --------------
+            - Run a million simulations on 4 processes, saving progress to book.ckpt
+              (run the same command again to resume after an interruption):
 
+                $python opening_book.py -n 1000000 -p 4 -c book.ckpt
 
-NUM_ROUNDS = 10
+            - Spend a million simulations on the most promising openings instead:
+
+                $python opening_book.py -n 1000000 -p 4 -c uct.ckpt --method uct
+
+            - Merge the tables of two runs with different seeds into data.pickle:
+
+                $python opening_book.py -n 0 -m run1.ckpt run2.ckpt
+        """)
+    )
+    parser.add_argument(
+        '-n', '--simulations', type=int, default=NUM_SIMULATIONS,
+        help="Set the number of simulations to run (0 to only merge checkpoints)."
+    )
+    parser.add_argument(
+        '-d', '--depth', type=int, default=BOOK_DEPTH,
+        help="Set the number of plies covered by the book."
+    )
+    parser.add_argument(
+        '-p', '--processes', type=int, default=None,
+        help="Set the number of worker processes (default: the number of CPUs)."
+    )
+    parser.add_argument(
+        '-c', '--checkpoint', default=None,
+        help="Save progress to this file, and resume from it if it exists."
+    )
+    parser.add_argument(
+        '-s', '--seed', type=int, default=0,
+        help="Set the random seed; runs to be merged need different seeds."
+    )
+    parser.add_argument(
+        '--method', choices=list(METHODS), default="uniform",
+        help="Choose how lines of play are selected for simulation."
+    )
+    parser.add_argument(
+        '--min_visits', type=int, default=1,
+        help="Leave out of the output the states simulated fewer times than this."
+    )
+    parser.add_argument(
+        '-m', '--merge', nargs='*', default=[],
+        help="Add the tables of these checkpoints to the book."
+    )
+    parser.add_argument(
+        '-o', '--output', default="data.pickle",
+        help="Write the state -> action table to this file."
+    )
+    args = parser.parse_args()
+
+    previous = None
+
+    def print_report(book):
+        global previous
+        report, previous = convergence_report(book, previous)
+        print(", ".join("{}: {}".format(k, round(v, 3) if isinstance(v, float) else v)
+                        for k, v in report.items()))
 
-if __name__ == "__main__":
-    print("Enter>>>")
     start = time.time()
-    open_book = build_table(NUM_ROUNDS)
-    print(open_book)
-    end = time.time()
-    print("The total time for {} rounds is {} seconds, the average time for each round is {} seconds per round".format(NUM_ROUNDS,end-start,(end-start)/NUM_ROUNDS))
-    with open("data.pickle", 'wb') as f:
-        pickle.dump(open_book, f)
\ No newline at end of file
+    book = new_book()
+    if args.simulations > 0:
+        book = build_book(args.simulations, args.depth, args.processes, args.checkpoint, args.seed,
+                          method=args.method, progress=print_report)
+        print("Simulated {} games in {:.1f} seconds".format(args.simulations, time.time() - start))
+    for path in args.merge:
+        merge_books(book, load_checkpoint(path)["book"])
+    open_book = best_actions(book, args.min_visits)
+    print("Writing {} book entries to {}".format(len(open_book), args.output))
+    with open(args.output, 'wb') as f:
+        pickle.dump(open_book, f)
@@ -2,22 +2,25 @@
 #                    YOU DO NOT NEED TO MODIFY THIS FILE                      #
 ###############################################################################
 import argparse
+import contextlib
+import itertools
 import logging
 import math
 import os
 import random
 import textwrap
 
-from multiprocessing.pool import ThreadPool as Pool
-
-from isolation import Isolation, Agent, play
+from isolation import Isolation, Agent
 from sample_players import RandomPlayer, GreedyPlayer, MinimaxPlayer
 from my_custom_player import CustomPlayer
+from tournament import (RESULTS_FILE, ResultWriter, SearchSummary, TournamentPool, elo_interval,
+                        play_recorded, sprt)
 
 logger = logging.getLogger(__name__)
 
-NUM_PROCS = 1
+NUM_PROCS = None  # number of games played in parallel; None plays one per available core
 NUM_ROUNDS = 5  # number times to replicate the match; increase for higher confidence estimate
+GAUNTLET = ["RANDOM", "GREEDY", "MINIMAX"]  # default opponents in tournament modes
 TIME_LIMIT = 150  # number of milliseconds before timeout
 
 TEST_AGENTS = {
@@ -28,28 +31,29 @@ TEST_AGENTS = {
 }
 
 
-def _run_matches(matches, name, num_processes=NUM_PROCS):
+def _run_matches(matches, name, num_processes=NUM_PROCS, on_record=None):
     results = []
-    pool = Pool(num_processes)
     print("Running {} games:".format(len(matches)))
-    for result in pool.imap_unordered(play, matches):
-        print("+" if result[0].name == name else '-', end="")
-        results.append(result)
+    with TournamentPool(num_processes) as pool:
+        for result, record in pool.imap_unordered(play_recorded, matches):
+            print("+" if result[0].name == name else '-', end="", flush=True)
+            results.append(result)
+            if on_record: on_record(record)
     print()
     return results
 
 
 def make_fair_matches(matches, results):
     new_matches = []
-    for _, game_history, match_id in results:
+    for _, game_history, match_id, _ in results:
         match = matches[match_id]
         state = Isolation()
         state = state.result(game_history[0]).result(game_history[1])
-        new_matches.append((match[0][::-1], match[1], match[2], -match_id))
+        new_matches.append((match[0][::-1], match[1], match[2], -match_id) + match[4:])
     return new_matches
 
 
-def play_matches(custom_agent, test_agent, cli_args):
+def play_matches(custom_agent, test_agent, cli_args, on_record=None):
     """ Play a specified number of rounds between two agents. Each round
     consists of two games, and each player plays as first player in one
     game and second player in the other. (This mitigates "unfair" games
@@ -66,27 +70,119 @@ def play_matches(custom_agent, test_agent, cli_args):
     for match_id in range(cli_args.rounds):
         # initialize all games with a random move and response
         state = Isolation()
-        matches.append(((test_agent, custom_agent), state, cli_args.time_limit, match_id))
-        matches.append(((custom_agent, test_agent), state, cli_args.time_limit, match_id))
-    results = _run_matches(matches, custom_agent.name, cli_args.processes)
+        matches.append(((test_agent, custom_agent), state, cli_args.time_limit, match_id,
+                        cli_args.persistent_workers))
+        matches.append(((custom_agent, test_agent), state, cli_args.time_limit, match_id,
+                        cli_args.persistent_workers))
+    results = _run_matches(matches, custom_agent.name, cli_args.processes, on_record)
 
     if cli_args.fair_matches:
         _matches = make_fair_matches(matches, results)
-        results.extend(_run_matches(_matches, custom_agent.name, cli_args.processes))
+        results.extend(_run_matches(_matches, custom_agent.name, cli_args.processes, on_record))
 
     wins = sum(int(r[0].name == custom_agent.name) for r in results)
     return wins, len(matches) * (1 + int(cli_args.fair_matches))
 
 
+def play_tournament(agents, pairings, cli_args, on_record=None):
+    """ Play up to the specified number of rounds between each pairing of
+    agents; each round is two games, with each agent moving first in one.
+
+    With cli_args.sprt = (elo0, elo1), a sequential probability ratio test
+    runs on the results of each pairing after every game, and a pairing is
+    not scheduled for more rounds once the test accepts that the first
+    agent is elo0 or elo1 Elo stronger than the second. Games already
+    running are still counted.
+
+    on_record, if given, is called with the record of each game (see
+    tournament.game_record()).
+
+    Returns a dict of pairing -> [wins of first agent, wins of second agent]
+    and a dict of pairing -> SPRT decision ("H0", "H1" or None).
+    """
+    results = {pairing: [0, 0] for pairing in pairings}
+    decisions = {pairing: None for pairing in pairings}
+    scheduled = {}  # match_id -> pairing
+
+    def schedule():
+        match_id = 0
+        for _ in range(cli_args.rounds):
+            for pairing in pairings:
+                if decisions[pairing] is not None:
+                    continue
+                first, second = (agents[i] for i in pairing)
+                for players in ((first, second), (second, first)):
+                    scheduled[match_id] = pairing
+                    yield (players, Isolation(), cli_args.time_limit, match_id,
+                           cli_args.persistent_workers)
+                    match_id += 1
+
+    print("Running up to {} games:".format(2 * cli_args.rounds * len(pairings)))
+    with TournamentPool(cli_args.processes) as pool:
+        for (winner, _, match_id, _), record in pool.imap_unordered(play_recorded, schedule()):
+            if on_record: on_record(record)
+            pairing = scheduled.pop(match_id)
+            results[pairing][int(winner.name != agents[pairing[0]].name)] += 1
+            if cli_args.sprt and decisions[pairing] is None:
+                decisions[pairing] = sprt(*results[pairing], *cli_args.sprt)[1]
+            print(".", end="", flush=True)
+    print()
+    return results, decisions
+
+
+def tournament_report(agents, results, decisions):
+    """ Return the lines of the tournament results: the Elo difference of
+    each pairing and the performance of each agent against its opponents,
+    with 95% confidence intervals
+    """
+    lines = []
+    scores = [[0, 0] for _ in agents]  # wins and games of each agent
+    for (i, j), (wins, losses) in sorted(results.items()):
+        scores[i][0] += wins
+        scores[j][0] += losses
+        scores[i][1] += wins + losses
+        scores[j][1] += wins + losses
+        decision = decisions[(i, j)]
+        lines.append("{} vs {}: {}-{}, Elo {:+.0f} [{:+.0f}, {:+.0f}]{}".format(
+            agents[i].name, agents[j].name, wins, losses, *elo_interval(wins, wins + losses),
+            ", SPRT accepted " + decision if decision else ""))
+    for agent, (wins, games) in zip(agents, scores):
+        lines.append("{}: won {} of {} games, performance {:+.0f} [{:+.0f}, {:+.0f}] Elo".format(
+            agent.name, wins, games, *elo_interval(wins, games)))
+    return lines
+
+
 def main(args):
-    test_agent = TEST_AGENTS[args.opponent.upper()]
     custom_agent = Agent(CustomPlayer, "Custom Agent")
-    wins, num_games = play_matches(custom_agent, test_agent, args)
+    summary = SearchSummary()
+    with ResultWriter(args.results) if args.results else contextlib.nullcontext() as sink:
+        def on_record(record):
+            summary.add(record)
+            if sink: sink.write(record)
+
+        if args.mode != "match":
+            agents = [custom_agent] + [TEST_AGENTS[name.upper()] for name in args.agents]
+            if args.mode == "gauntlet":
+                pairings = [(0, i) for i in range(1, len(agents))]
+            else:
+                pairings = list(itertools.combinations(range(len(agents)), 2))
+            results, decisions = play_tournament(agents, pairings, args, on_record)
+            for line in tournament_report(agents, results, decisions) + summary.report():
+                logger.info(line)
+                print(line)
+            print()
+            return
+
+        test_agent = TEST_AGENTS[args.opponent.upper()]
+        wins, num_games = play_matches(custom_agent, test_agent, args, on_record)
 
     logger.info("Your agent won {:.1f}% of matches against {}".format(
        100. * wins / num_games, test_agent.name))
     print("Your agent won {:.1f}% of matches against {}".format(
        100. * wins / num_games, test_agent.name))
+    for line in summary.report():
+        logger.info(line)
+        print(line)
     print()
 
 
@@ -104,7 +200,12 @@ if __name__ == "__main__":
 
             - Run 100 rounds (100 rounds = 200 games) against the minimax agent with 1 process:
 
-                $python run_match.py -r 100
+                $python run_match.py -r 100 -p 1
+
+            - Play your agent against each of the greedy and minimax agents for up to 500
+              rounds, stopping each pairing once the test between +0 and +50 Elo is settled:
+
+                $python run_match.py -m gauntlet -a GREEDY MINIMAX -r 500 --sprt 0 50
         """)
     )
     parser.add_argument(
@@ -133,29 +234,77 @@ if __name__ == "__main__":
             for initial testing because they run more quickly than the minimax agent.
         """
     )
+    parser.add_argument(
+        '-m', '--mode', choices=["match", "gauntlet", "round_robin"], default="match",
+        help="""\
+            Choose 'match' to play your agent against the opponent, 'gauntlet' to play 
+            it against each of the agents, or 'round_robin' to play every pair among 
+            your agent and the agents.  Tournament modes report Elo differences with 
+            95%% confidence intervals, and ignore the fair matches flag.
+        """
+    )
+    parser.add_argument(
+        '-a', '--agents', nargs='+', default=GAUNTLET, choices=list(TEST_AGENTS.keys()),
+        help="Choose the agents for the gauntlet and round robin modes."
+    )
+    parser.add_argument(
+        '--sprt', type=float, nargs=2, metavar=("ELO0", "ELO1"),
+        help="""\
+            Stop playing a pairing once a sequential probability ratio test accepts 
+            that the first agent is ELO0 Elo or ELO1 Elo stronger than the second 
+            (5%% error rates) in the tournament modes.  Use with a large number of 
+            rounds, which becomes the maximum.
+        """
+    )
     parser.add_argument(
         '-p', '--processes', type=int, default=NUM_PROCS,
         help="""\
-            Set the number of parallel processes to use for running matches.  WARNING: 
-            Windows users may see inconsistent performance using >1 thread.  Check the 
-            log file for time out errors and increase the time limit (add 50-100ms) if 
-            your agent performs poorly.
+            Set the number of games to play in parallel (default: one per available 
+            core).  Each game runs in its own process, pinned to one core where the 
+            platform supports it; using more processes than cores makes agents share 
+            cores.  Check the log file for time out errors and increase the time limit 
+            (add 50-100ms) if your agent performs poorly.
         """
     )
     parser.add_argument(
         '-t', '--time_limit', type=int, default=TIME_LIMIT,
         help="Set the maximum allowed time (in milliseconds) for each call to agent.get_action()."
     )
+    parser.add_argument(
+        '-w', '--persistent_workers', action="store_true",
+        help="""\
+            Run each agent in one long-lived worker process per game instead of 
+            starting a new process for every move.  (This removes the process 
+            startup cost from every move and speeds up tournaments.)
+        """
+    )
+    parser.add_argument(
+        '-j', '--results', nargs='?', const=RESULTS_FILE,
+        help="""\
+            Append a JSON record of every game (agents, opening, moves, time per move, 
+            status and winner) to a JSON Lines file (default file: {}).
+        """.format(RESULTS_FILE)
+    )
+    parser.add_argument(
+        '-v', '--verbose', action="store_true",
+        help="""\
+            Log the details of every game to matches.log (otherwise only errors are 
+            logged).  Formatting and writing the log slows down long tournaments.
+        """
+    )
     args = parser.parse_args()
 
-    logging.basicConfig(filename="matches.log", filemode="w", level=logging.DEBUG)
+    logging.basicConfig(filename="matches.log", filemode="w",
+                        level=logging.DEBUG if args.verbose else logging.WARNING)
     logging.info(
         "Search Configuration:\n" +
-        "Opponent: {}\n".format(args.opponent) +
+        "Mode: {}\n".format(args.mode) +
+        "Opponent: {}\n".format(args.opponent if args.mode == "match" else " ".join(args.agents)) +
         "Rounds: {}\n".format(args.rounds) +
         "Fair Matches: {}\n".format(args.fair_matches) +
         "Time Limit: {}\n".format(args.time_limit) +
-        "Processes: {}".format(args.processes)
+        "Processes: {}\n".format(args.processes) +
+        "Persistent Workers: {}".format(args.persistent_workers)
     )
 
     main(args)
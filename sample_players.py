@@ -2,9 +2,13 @@
 #     YOU CAN MODIFY THIS FILE, BUT CHANGES WILL NOT APPLY DURING GRADING     #
 ###############################################################################
 import logging
+import os
 import pickle
 import random
 
+from binary_book import BOOK_FILE, BinaryBook
+from isolation import SearchStats
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,6 +19,7 @@ class BasePlayer:
         self.queue = None
         self.context = None
         self.data = None
+        self.stats = SearchStats()  # replaced with a new record for each move by the harness
 
     def get_action(self, state):
         """ Implement a function that calls self.queue.put(ACTION) within the allowed time limit 
@@ -27,6 +32,10 @@ class BasePlayer:
 class DataPlayer(BasePlayer):
     def __init__(self, player_id):
         super().__init__(player_id)
+        # a binary book is memory-mapped on first use and shared by all players
+        if os.path.exists(BOOK_FILE):
+            self.data = BinaryBook.open(BOOK_FILE)
+            return
         try:
             with open("data.pickle", "rb") as f:
                 self.data = pickle.load(f)
@@ -53,9 +62,7 @@ class GreedyPlayer(BasePlayer):
     equivalent to a minimax search agent with a search depth of one.
     """
     def score(self, state):
-        own_loc = state.locs[self.player_id]
-        own_liberties = state.liberties(own_loc)
-        return len(own_liberties)
+        return state.num_liberties(self.player_id)
 
     def get_action(self, state):
         """Select the move from the available legal moves with the highest
@@ -106,8 +113,11 @@ class MinimaxPlayer(BasePlayer):
         self.queue.put(self.minimax(state, depth=3))
 
     def minimax(self, state, depth):
+        stats = self.stats  # count the nodes searched (see isolation.SearchStats)
+        stats.depth, stats.iterations = depth, 1
 
         def min_value(state, depth):
+            stats.nodes += 1
             if state.terminal_test(): return state.utility(self.player_id)
             if depth <= 0: return self.score(state)
             value = float("inf")
@@ -116,6 +126,7 @@ class MinimaxPlayer(BasePlayer):
             return value
 
         def max_value(state, depth):
+            stats.nodes += 1
             if state.terminal_test(): return state.utility(self.player_id)
             if depth <= 0: return self.score(state)
             value = float("-inf")
@@ -126,8 +137,4 @@ class MinimaxPlayer(BasePlayer):
         return max(state.actions(), key=lambda x: min_value(state.result(x), depth - 1))
 
     def score(self, state):
-        own_loc = state.locs[self.player_id]
-        opp_loc = state.locs[1 - self.player_id]
-        own_liberties = state.liberties(own_loc)
-        opp_liberties = state.liberties(opp_loc)
-        return len(own_liberties) - len(opp_liberties)
+        return state.mobility_diff(self.player_id)
@@ -0,0 +1,77 @@
+## Mutable game state with make/unmake moves for search
+
+from isolation import Isolation
+from transposition import _ZOBRIST_CELL, _ZOBRIST_LOC, _ZOBRIST_SIDE, zobrist_hash
+
+
+class SearchBoard():
+    """
+    Mutable counterpart of an Isolation state for search. push(action) plays
+    a move in place and pop() takes back the last move pushed, so that a
+    search does not allocate a new state for every node. The Zobrist hash of
+    the position (see transposition.zobrist_hash) is kept up to date in
+    self.key.
+
+    The board, ply_count and locs attributes and the read-only methods of
+    Isolation (actions, player, outcome, terminal_test, liberties,
+    num_liberties, mobility_diff) are shared with the Isolation class, so
+    heuristics written for Isolation states accept a SearchBoard. Note that
+    locs is a list, and that every attribute changes as moves are pushed
+    and popped; use to_state() to keep a position.
+    """
+    __slots__ = ("board", "ply_count", "locs", "key", "_old_locs")
+
+    actions = Isolation.actions
+    player = Isolation.player
+    outcome = Isolation.outcome
+    terminal_test = Isolation.terminal_test
+    liberties = Isolation.liberties
+    num_liberties = Isolation.num_liberties
+    mobility_diff = Isolation.mobility_diff
+
+    def __init__(self, state):
+        self.board = state.board
+        self.ply_count = state.ply_count
+        self.locs = list(state.locs)
+        self.key = zobrist_hash(state)
+        self._old_locs = []  # the location before each pushed move, for pop()
+
+    def __repr__(self):
+        return "SearchBoard({!r})".format(self.to_state())
+
+    def to_state(self):
+        """ Return the current position as an Isolation state """
+        return Isolation(board=self.board, ply_count=self.ply_count, locs=tuple(self.locs))
+
+    def push(self, action):
+        """ Play a legal action for the active player; unlike
+        Isolation.result(), the action is not validated
+        """
+        player_id = self.ply_count & 1
+        old_loc = self.locs[player_id]
+        new_loc = action if old_loc is None else old_loc + action
+        self.board ^= 1 << new_loc
+        self.locs[player_id] = new_loc
+        key = self.key ^ _ZOBRIST_CELL[new_loc] ^ _ZOBRIST_LOC[player_id][new_loc] ^ _ZOBRIST_SIDE
+        if old_loc is not None:
+            key ^= _ZOBRIST_LOC[player_id][old_loc]
+        self.key = key
+        self.ply_count += 1
+        self._old_locs.append(old_loc)
+
+    def pop(self):
+        """ Take back the last action pushed """
+        old_loc = self._old_locs.pop()
+        self.ply_count -= 1
+        player_id = self.ply_count & 1
+        new_loc = self.locs[player_id]
+        self.board ^= 1 << new_loc
+        self.locs[player_id] = old_loc
+        key = self.key ^ _ZOBRIST_CELL[new_loc] ^ _ZOBRIST_LOC[player_id][new_loc] ^ _ZOBRIST_SIDE
+        if old_loc is not None:
+            key ^= _ZOBRIST_LOC[player_id][old_loc]
+        self.key = key
+
+    def depth(self):
+        """ Return the number of moves that can be popped """
+        return len(self._old_locs)
@@ -0,0 +1,113 @@
+## Board symmetries of knight's Isolation
+#
+# The 11x9 board has four symmetries: the identity, the left-right mirror,
+# the up-down mirror and their composition (a half turn). Each of them is its
+# own inverse. Boards are transformed one row at a time with a table of
+# reversed rows, and locations and actions with precomputed tables.
+
+from isolation import Isolation
+from isolation.isolation import Action, _HEIGHT, _SIZE, _WIDTH
+
+IDENTITY, LR, UD, LRUD = "ID", "LR", "UD", "LRUD"
+TRANSFORMS = (IDENTITY, LR, UD, LRUD)
+
+_ROW_BITS = _WIDTH + 2  # bits per board row, including two padding bits
+_ROW_MASK = (1 << _WIDTH) - 1
+_REVERSED_ROW = [int(format(row, "0{}b".format(_WIDTH))[::-1], 2) for row in range(1 << _WIDTH)]
+
+
+def _map_loc(loc, transform):
+    row, col = divmod(loc, _ROW_BITS)
+    if transform in (LR, LRUD):
+        col = _WIDTH - 1 - col
+    if transform in (UD, LRUD):
+        row = _HEIGHT - 1 - row
+    return row * _ROW_BITS + col
+
+
+# _LOCS[transform][loc] is the image of cell loc, and _ACTIONS[transform][action]
+# the image of a knight move (the move between the images of its endpoints)
+_LOCS = {t: tuple(_map_loc(loc, t) for loc in range(_SIZE)) for t in TRANSFORMS}
+_CENTER = (_HEIGHT // 2) * _ROW_BITS + _WIDTH // 2
+_ACTIONS = {t: {a: Action(_LOCS[t][_CENTER + a] - _LOCS[t][_CENTER]) for a in Action}
+            for t in TRANSFORMS}
+
+
+def transform_board(board, transform):
+    """ Return the image of a bitboard under a symmetry
+
+    :param board: int; a bitboard with the layout of Isolation.board
+    :param transform: one of TRANSFORMS
+    :return: int
+    """
+    if transform == IDENTITY:
+        return board
+    rows = [(board >> (r * _ROW_BITS)) & _ROW_MASK for r in range(_HEIGHT)]
+    if transform != UD:
+        rows = [_REVERSED_ROW[row] for row in rows]
+    if transform != LR:
+        rows.reverse()
+    result = 0
+    for row in reversed(rows):
+        result = (result << _ROW_BITS) | row
+    return result
+
+
+def transform_loc(loc, transform):
+    """ Return the image of a cell (or None) under a symmetry """
+    return None if loc is None else _LOCS[transform][loc]
+
+
+def transform_action(action, transform):
+    """ Return the image of an action under a symmetry. Knight moves must be
+    Action members, as returned by Isolation.actions(); plain ints are
+    opening moves (cell numbers), some of which equal an Action value.
+    """
+    if isinstance(action, Action):
+        return _ACTIONS[transform][action]
+    return _LOCS[transform][action]
+
+
+def inverse_action(action, transform):
+    """ Map an action in the transformed position back to the original one;
+    every symmetry of the board is its own inverse
+    """
+    return transform_action(action, transform)
+
+
+def transform_state(state, transform):
+    """ Return the image of an Isolation state under a symmetry """
+    return Isolation(board=transform_board(state.board, transform), ply_count=state.ply_count,
+                     locs=tuple(transform_loc(loc, transform) for loc in state.locs))
+
+
+def canonicalize(state):
+    """
+    Return the canonical representative of the state's symmetry class (the
+    image with the smallest (board, locs) key) and the symmetry that maps
+    the state to it. Symmetric states have the same canonical state, so
+    tables keyed by it share their entries; actions chosen in the canonical
+    state are mapped back with inverse_action().
+
+    :param state: Isolation
+    :return: (Isolation, transform)
+    """
+    board = state.board
+    rows = [(board >> (r * _ROW_BITS)) & _ROW_MASK for r in range(_HEIGHT)]
+    mirrored = [_REVERSED_ROW[row] for row in rows]
+    boards = {IDENTITY: board}
+    for transform, image in ((LR, mirrored), (UD, rows[::-1]), (LRUD, mirrored[::-1])):
+        value = 0
+        for row in reversed(image):
+            value = (value << _ROW_BITS) | row
+        boards[transform] = value
+
+    def key(transform):
+        locs = [-1 if loc is None else _LOCS[transform][loc] for loc in state.locs]
+        return boards[transform], locs[0], locs[1]
+
+    transform = min(TRANSFORMS, key=key)
+    if transform == IDENTITY:
+        return state, IDENTITY
+    return Isolation(board=boards[transform], ply_count=state.ply_count,
+                     locs=tuple(transform_loc(loc, transform) for loc in state.locs)), transform
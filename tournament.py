@@ -0,0 +1,347 @@
+## Process pool for running isolation matches in parallel
+#
+# multiprocessing.Pool workers are daemon processes, which cannot start the
+# agent processes that isolation.play() forks for every move, and a
+# ThreadPool runs the game loops of all matches under one GIL. A
+# TournamentPool runs each match in its own long-lived (non-daemon) worker
+# process instead. Every worker is pinned to one core where the platform
+# supports it (os.sched_setaffinity); the agent processes a worker starts
+# inherit its affinity, so concurrent games do not compete for the same core
+# and each search gets the same share of the machine.
+
+import json
+import math
+import os
+import queue
+import threading
+import time
+import traceback
+
+from collections import Counter
+from multiprocessing import Process, Queue
+from queue import Empty
+
+from isolation import play
+
+POLL_INTERVAL = 1  # seconds between checks that the workers are still alive
+CONFIDENCE_Z = 1.96  # normal quantile of the 95% confidence intervals on ratings
+SPRT_ALPHA = 0.05  # probability of accepting H1 when H0 is true
+SPRT_BETA = 0.05  # probability of accepting H0 when H1 is true
+RESULTS_FILE = "matches.jsonl"
+NEAR_DEADLINE = 0.9  # a move that takes this fraction of the time limit is close to timing out
+
+
+def available_cores():
+    """ Return the sorted list of cores this process may run on """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class TournamentPool():
+    """
+    Pool of worker processes that play matches and stream back the results
+    as games finish.
+
+    Use it like multiprocessing.Pool, e.g.,
+
+        with TournamentPool(4) as pool:
+            for result in pool.imap_unordered(play, matches):
+                ...
+
+    The number of processes defaults to the number of available cores; use
+    at most one process per core to keep per-move timing fair. With more
+    processes than cores, the workers share cores round-robin.
+    """
+    def __init__(self, processes=None, pin=True):
+        cores = available_cores()
+        self.processes = processes or len(cores)
+        self._tasks = Queue()
+        self._results = Queue()
+        self._workers = []
+        for i in range(self.processes):
+            core = cores[i % len(cores)] if pin else None
+            worker = Process(target=_serve_matches, args=(self._tasks, self._results, core))
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def imap_unordered(self, func, iterable):
+        """
+        Call func on each item of iterable in the worker processes, and yield
+        the return values in the order the calls finish.
+
+        Items are taken from iterable only as workers become free, so it may
+        be unbounded or generate matches based on earlier results. If the
+        caller stops iterating early, the calls already running are finished
+        and their results discarded when the generator is closed.
+
+        :param func: picklable function, e.g., isolation.play
+        :param iterable: the arguments of each call, e.g., match tuples
+        """
+        iterator = iter(iterable)
+        pending = 0
+        try:
+            for args in iterator:
+                self._tasks.put((func, args))
+                pending += 1
+                if pending == self.processes:
+                    break
+            while pending:
+                ok, value = self._get_result()
+                pending -= 1
+                if not ok:
+                    raise RuntimeError("A match raised an exception in a tournament worker:\n" + value)
+                for args in iterator:
+                    self._tasks.put((func, args))
+                    pending += 1
+                    break
+                yield value
+        finally:
+            for _ in range(pending):
+                if self._workers:
+                    self._get_result()
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._results.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    self.terminate()
+                    raise RuntimeError("A tournament worker process exited unexpectedly")
+
+    def close(self):
+        """ Stop the workers after the queued matches are finished """
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def terminate(self):
+        """ Stop the workers immediately """
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        self._workers = []
+
+
+def _serve_matches(tasks, results, core):
+    """ Main loop of a TournamentPool worker process """
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        func, args = task
+        try:
+            results.put((True, func(args)))
+        except Exception:
+            results.put((False, traceback.format_exc()))
+
+
+def play_recorded(match):
+    """ Play a match like isolation.play(), and return the result with the
+    record of the game (see game_record()), built in the worker process
+    """
+    result = play(match)
+    return result, game_record(match, result)
+
+
+###################################################################
+#########################  results file  ##########################
+###################################################################
+# One JSON object per line and per game, e.g.,
+#   {"match_id": 3, "agents": ["Custom Agent", "Greedy Agent"],
+#    "time_limit": 150, "initial": {"board": ..., "ply_count": 0, "locs": [null, null]},
+#    "opening": [57, 60], "moves": [57, 60, 25, ...], "move_ms": [12.5, ...],
+#    "stats": [{"nodes": 0, "depth": 0, ...}, ...],
+#    "status": "GAME_OVER", "winner": "Custom Agent", "winner_id": 0, "time": 1700000000.0}
+# Opening moves are cell numbers and later moves are Action values. move_ms
+# and stats (see isolation.SearchStats; null if the agent returned none)
+# have an entry for every move, including a final move that timed out.
+
+def game_record(match, result):
+    """
+    Return the JSON-serializable record of a game.
+
+    :param match: the arguments of isolation.play(); (agents, initial
+        state, time limit, match id, ...)
+    :param result: the value isolation.play() returned for the match
+    :return: dict
+    """
+    agents, initial_state, time_limit = match[:3]
+    winner, history, match_id, info = result
+    moves = [int(action) for action in history]
+    return {
+        "match_id": match_id,
+        "agents": [agent.name for agent in agents],
+        "time_limit": time_limit,
+        "initial": {"board": initial_state.board, "ply_count": initial_state.ply_count,
+                    "locs": list(initial_state.locs)},
+        "opening": moves[:2],
+        "moves": moves,
+        "move_ms": [round(t, 1) for t in info.move_times],
+        "stats": [None if s is None else s.as_dict() for s in info.search_stats],
+        "status": info.status.name,
+        "winner": winner.name,
+        "winner_id": [agent.name for agent in agents].index(winner.name),
+        "time": time.time(),
+    }
+
+
+class ResultWriter():
+    """
+    Append game records to a JSON Lines file from a background thread.
+
+    write() only queues the record, so the thread that collects results is
+    never blocked on serialization or disk writes. Lines are buffered and
+    flushed whenever the queue runs empty, and the file is complete after
+    close() (or the end of a with block).
+    """
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self._queue = queue.Queue()
+        self._file = open(path, "a")
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        """ Queue a record (a JSON-serializable dict) for writing """
+        self._queue.put(record)
+
+    def close(self):
+        """ Write the queued records and close the file """
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _serve(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            if self._queue.empty():
+                self._file.flush()
+
+
+class SearchSummary():
+    """
+    Aggregate of the search statistics in game records for each agent: the
+    mean nodes per second (over the moves that report nodes), the
+    distribution of search depths, the mean fraction of the time limit used,
+    and the number of moves that came close to the deadline or timed out.
+    """
+    def __init__(self):
+        self.agents = {}
+
+    def add(self, record):
+        """ Add the moves of a game record (see game_record()) """
+        first_ply = record["initial"]["ply_count"]
+        for i, (move_ms, stats) in enumerate(zip(record["move_ms"], record["stats"])):
+            name = record["agents"][(first_ply + i) % 2]
+            totals = self.agents.setdefault(name, {
+                "moves": 0, "nodes": 0, "search_ms": 0., "time_used": 0., "depths": Counter(),
+                "near_deadline": 0, "timeouts": 0})
+            totals["moves"] += 1
+            totals["time_used"] += move_ms / record["time_limit"]
+            if move_ms >= NEAR_DEADLINE * record["time_limit"]:
+                totals["near_deadline"] += 1
+            if stats is not None and stats["nodes"]:
+                totals["nodes"] += stats["nodes"]
+                totals["search_ms"] += stats["time_ms"]
+            if stats is not None and stats["depth"]:
+                totals["depths"][stats["depth"]] += 1
+        if record["status"] == "TIMEOUT":
+            name = record["agents"][(first_ply + len(record["move_ms"]) - 1) % 2]
+            self.agents[name]["timeouts"] += 1
+
+    def report(self):
+        """ Return one line of summary for each agent """
+        lines = []
+        for name, totals in sorted(self.agents.items()):
+            line = "{}: {} moves, {:.0%} of the time limit used on average".format(
+                name, totals["moves"], totals["time_used"] / totals["moves"])
+            if totals["search_ms"]:
+                line += ", {:.0f} nodes/sec".format(1000 * totals["nodes"] / totals["search_ms"])
+            if totals["depths"]:
+                depths = totals["depths"]
+                line += ", mean depth {:.1f} ({})".format(
+                    sum(d * n for d, n in depths.items()) / sum(depths.values()),
+                    " ".join("{}:{}".format(d, depths[d]) for d in sorted(depths)))
+            line += ", {} moves near the deadline, {} timeouts".format(
+                totals["near_deadline"], totals["timeouts"])
+            lines.append(line)
+        return lines
+
+
+###################################################################
+######################  ratings and testing  ######################
+###################################################################
+# Isolation games always have a winner, so the results between two agents
+# are binomial and the Elo difference follows from the fraction of games
+# won, score = 1 / (1 + 10 ** (-elo / 400)).
+
+def elo_difference(score):
+    """ Return the Elo difference implied by the fraction of games won """
+    if score <= 0:
+        return float("-inf")
+    if score >= 1:
+        return float("inf")
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo):
+    """ Return the expected fraction of games won with an Elo advantage """
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_interval(wins, games, z=CONFIDENCE_Z):
+    """
+    Return the Elo difference measured by a number of wins, with the bounds
+    of its confidence interval (from the Wilson interval of the score, which
+    stays finite when every game was won or lost).
+
+    :return: (elo, lower, upper)
+    """
+    if not games:
+        return 0., float("-inf"), float("inf")
+    p = wins / games
+    center = p + z * z / (2 * games)
+    spread = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games))
+    lower = (center - spread) / (1 + z * z / games)
+    upper = (center + spread) / (1 + z * z / games)
+    return elo_difference(p), elo_difference(lower), elo_difference(upper)
+
+
+def sprt(wins, losses, elo0, elo1, alpha=SPRT_ALPHA, beta=SPRT_BETA):
+    """
+    Sequential probability ratio test of H0: the Elo difference is elo0,
+    against H1: it is elo1 (elo0 < elo1), on the results so far. Stopping at
+    the first decision keeps the error rates near alpha and beta however
+    often the test is run.
+
+    :return: (float, str); the log-likelihood ratio and "H0" or "H1" once
+        one of them is accepted, None while the result is undecided
+    """
+    p0, p1 = expected_score(elo0), expected_score(elo1)
+    llr = wins * math.log(p1 / p0) + losses * math.log((1 - p1) / (1 - p0))
+    if llr >= math.log((1 - beta) / alpha):
+        return llr, "H1"
+    if llr <= math.log(beta / (1 - alpha)):
+        return llr, "H0"
+    return llr, None
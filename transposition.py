@@ -0,0 +1,200 @@
+## Zobrist hashing and transposition table for alpha-beta search
+
+import random
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from isolation.isolation import _BLANK_BOARD, _SIZE
+
+# Zobrist keys: one per blocked cell, one per (player, location) pair, and
+# one for the side to move. The generator is seeded so that hashes agree
+# between the processes that play a game (tables travel through self.context)
+_rng = random.Random(0x150)
+_ZOBRIST_CELL = [_rng.getrandbits(64) for _ in range(_SIZE)]
+_ZOBRIST_LOC = [[_rng.getrandbits(64) for _ in range(_SIZE)] for _ in range(2)]
+_ZOBRIST_SIDE = _rng.getrandbits(64)
+del _rng
+
+# bound types stored with each table entry
+EXACT, LOWER, UPPER = 0, 1, 2
+
+TABLE_SIZE = 1 << 16  # default number of slots in a transposition table
+
+
+def zobrist_hash(state):
+    """ Return the Zobrist hash of an Isolation state computed from scratch
+
+    Use zobrist_update() to derive the hash of child states during search.
+    """
+    key = 0
+    blocked = _BLANK_BOARD & ~state.board
+    while blocked:
+        low_bit = blocked & -blocked
+        key ^= _ZOBRIST_CELL[low_bit.bit_length() - 1]
+        blocked ^= low_bit
+    for player_id, loc in enumerate(state.locs):
+        if loc is not None:
+            key ^= _ZOBRIST_LOC[player_id][loc]
+    if state.ply_count % 2:
+        key ^= _ZOBRIST_SIDE
+    return key
+
+
+def zobrist_update(key, player_id, old_loc, new_loc):
+    """ Return the hash of the state reached when player_id moves their token
+    from old_loc (None before their first move) to new_loc
+
+    :param key: int; the hash of the state before the move
+    :return: int
+    """
+    key ^= _ZOBRIST_CELL[new_loc] ^ _ZOBRIST_LOC[player_id][new_loc] ^ _ZOBRIST_SIDE
+    if old_loc is not None:
+        key ^= _ZOBRIST_LOC[player_id][old_loc]
+    return key
+
+
+class TranspositionTable():
+    """
+    Fixed-size hash table of search results keyed by Zobrist hash.
+
+    Each slot holds a single entry tuple (key, depth, bound, value, move, age).
+    Values are stored from the perspective of the searching player, so a
+    table must not be shared between the two players of a game.
+
+    Replacement policy: a new result always replaces an entry for the same
+    position, an entry written during an earlier search (see new_search()),
+    or an entry searched to the same or smaller depth; otherwise the deeper,
+    current entry is kept.
+    """
+    def __init__(self, size=TABLE_SIZE):
+        if size <= 0 or size & (size - 1):
+            raise ValueError("Transposition table size must be a power of two")
+        self.size = size
+        self.slots = [None] * size
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def new_search(self):
+        """ Mark the start of a new search (e.g., a new turn); entries from
+        earlier searches become the first candidates for replacement.
+        """
+        self.age += 1
+
+    def probe(self, key):
+        """
+        Look up the entry for a position.
+
+        :param key: int; Zobrist hash of the position
+        :return: (key, depth, bound, value, move, age) tuple or None
+        """
+        entry = self.slots[key & (self.size - 1)]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        """
+        Record a search result, subject to the replacement policy.
+
+        :param key: int; Zobrist hash of the position
+        :param depth: int; remaining search depth used to compute value
+        :param bound: EXACT, LOWER or UPPER
+        :param value: float; the search value
+        :param move: the best (or refuting) action found, or None
+        """
+        idx = key & (self.size - 1)
+        entry = self.slots[idx]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            self.slots[idx] = (key, depth, bound, value, move, self.age)
+            self.stores += 1
+
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        self.slots = [None] * self.size
+        self.hits = self.misses = self.stores = 0
+
+
+class SharedTranspositionTable():
+    """
+    Transposition table in shared memory, for worker processes forked after
+    the table is created (e.g., the workers of a multiprocessing.Pool).
+
+    Has the same interface and replacement policy as TranspositionTable. Each
+    slot holds two unsigned 64-bit words, (key ^ data, data), where data packs
+    the depth, bound, move, age and value of the entry. Slots are written
+    without locks; a probe that reads a slot while another process writes it
+    sees a key mismatch and counts as a miss. Values must be integers or
+    +/-inf. The hit/miss/store counters are local to each process.
+    """
+    def __init__(self, size=TABLE_SIZE):
+        if size <= 0 or size & (size - 1):
+            raise ValueError("Transposition table size must be a power of two")
+        self.size = size
+        self.slots = RawArray('Q', 2 * size)
+        self._age = RawValue('B', 0)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @property
+    def age(self):
+        return self._age.value
+
+    def new_search(self):
+        """ See TranspositionTable.new_search() """
+        self._age.value = (self._age.value + 1) & 0xff
+
+    def probe(self, key):
+        """ See TranspositionTable.probe() """
+        idx = (key & (self.size - 1)) << 1
+        data = self.slots[idx + 1]
+        if data and self.slots[idx] ^ data == key:
+            self.hits += 1
+            return (key,) + _unpack(data)
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        """ See TranspositionTable.store() """
+        idx = (key & (self.size - 1)) << 1
+        data = self.slots[idx + 1]
+        if data and self.slots[idx] ^ data != key and (data >> 18) & 0xff == self.age \
+                and depth < data & 0xff:
+            return
+        data = _pack(depth, bound, value, move, self.age)
+        self.slots[idx] = key ^ data
+        self.slots[idx + 1] = data
+        self.stores += 1
+
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        for i in range(2 * self.size):
+            self.slots[i] = 0
+        self.hits = self.misses = self.stores = 0
+
+
+_VALUE_INF = 1 << 30  # packed value standing in for +/-inf
+
+
+def _pack(depth, bound, value, move, age):
+    """ Pack an entry into a 58-bit integer: depth (8 bits), bound (2 bits),
+    move (8 bits, offset by 128; 0 is None), age (8 bits), value (32 bits)
+    """
+    if value == float("inf"):
+        value = _VALUE_INF
+    elif value == float("-inf"):
+        value = -_VALUE_INF
+    move = 0 if move is None else int(move) + 128
+    return depth | bound << 8 | move << 10 | age << 18 | (int(value) + (1 << 31)) << 26
+
+
+def _unpack(data):
+    """ Return the (depth, bound, value, move, age) tuple packed by _pack() """
+    value = (data >> 26) - (1 << 31)
+    if abs(value) == _VALUE_INF:
+        value = float("inf") if value > 0 else float("-inf")
+    move = (data >> 10) & 0xff
+    return data & 0xff, (data >> 8) & 0x3, value, (move - 128 if move else None), (data >> 18) & 0xff